@@ -0,0 +1,154 @@
+import os
+import json
+import shutil
+import hashlib
+import tarfile
+import subprocess
+import atexit
+from concurrent.futures import ThreadPoolExecutor
+
+from .printtools import *
+
+
+class Archiver():
+    """
+    Incremental archive of the working directory.
+    A manifest stores size, modification time and hash of every archived
+    file. Each call of archive only adds new or changed files to a new
+    tarball. The files are selected in the calling thread, the tarball is
+    written by a background thread, using a multi-threaded compressor if
+    available (zstd or pigz, else gzip from Python).
+    """
+
+    def __init__(self,dirname="archive",exclude=()):
+        self.dirname = dirname
+        self.manifest_file = os.path.join(dirname,"manifest.json")
+        self.exclude = set(exclude) | {dirname}
+        self.executor = None
+        self.future = None
+
+    def archive(self,name,exclude=()):
+        """
+        Start writing the new and changed files to the tarball with the
+        given name (without extension). Paths in exclude are skipped in
+        addition to the ones given at construction.
+        """
+        self.wait()
+        os.makedirs(self.dirname,exist_ok=True)
+        manifest = self.read_manifest()
+        changed = {}
+        for fn in self.files(self.exclude|set(exclude)):
+            st = os.stat(fn)
+            entry = manifest.get(fn)
+            if entry and entry["size"] == st.st_size and entry["mtime"] == st.st_mtime_ns:
+                continue
+            digest = file_hash(fn)
+            if entry and entry["hash"] == digest:
+                entry["mtime"] = st.st_mtime_ns
+                continue
+            changed[fn] = {"size":st.st_size, "mtime":st.st_mtime_ns, "hash":digest}
+        if not changed:
+            p_print("Archive: no new or changed files.")
+            self.write_manifest(manifest)
+            return
+        archive_name, cmd = self.compressor(os.path.join(self.dirname,name))
+        p_print("Write {} new or changed file(s) to {}".format(len(changed),yellow(archive_name)))
+        if not self.executor:
+            self.executor = ThreadPoolExecutor(max_workers=1)
+            atexit.register(self.wait)
+        self.future = self.executor.submit(self.write,archive_name,cmd,changed,manifest)
+
+    @staticmethod
+    def files(exclude):
+        """
+        all regular files in the working directory except for the
+        excluded ones (relative paths)
+        """
+        for root, dirs, files in os.walk("."):
+            dirs[:] = sorted(d for d in dirs if os.path.normpath(os.path.join(root,d)) not in exclude
+                             and not os.path.islink(os.path.join(root,d)))
+            for f in sorted(files):
+                fn = os.path.normpath(os.path.join(root,f))
+                if fn not in exclude and not os.path.islink(fn):
+                    yield fn
+
+    @staticmethod
+    def compressor(basename):
+        """
+        name of the tarball and command for the multi-threaded
+        compressor (None: compress with Python)
+        """
+        if shutil.which("zstd"):
+            return basename+".tar.zst", ["zstd","-T0","-q","-c"]
+        if shutil.which("pigz"):
+            return basename+".tar.gz", ["pigz","-c"]
+        return basename+".tar.gz", None
+
+    def write(self,archive_name,cmd,changed,manifest):
+        """
+        background thread: write tarball and update manifest
+        """
+        tmp_name = archive_name+".tmp"
+        if cmd:
+            with open(tmp_name,'wb') as f:
+                proc = subprocess.Popen(cmd,stdin=subprocess.PIPE,stdout=f)
+                with tarfile.open(fileobj=proc.stdin,mode="w|") as tar:
+                    self.add_files(tar,changed)
+                proc.stdin.close()
+                if proc.wait() != 0:
+                    raise Exception("Compression of "+archive_name+" failed.")
+        else:
+            with tarfile.open(tmp_name,"w:gz") as tar:
+                self.add_files(tar,changed)
+        os.replace(tmp_name,archive_name)
+        manifest.update(changed)
+        self.write_manifest(manifest)
+
+    @staticmethod
+    def add_files(tar,changed):
+        for fn, entry in list(changed.items()):
+            # the file can grow in the meantime (e.g. log files);
+            # only the part of the snapshot is archived.
+            try:
+                f = open(fn,'rb')
+            except FileNotFoundError:
+                del changed[fn]
+                continue
+            with f:
+                tarinfo = tar.gettarinfo(fn,fileobj=f)
+                if tarinfo.size < entry["size"]:
+                    # truncated in the meantime: the snapshot is gone,
+                    # the file is archived with the next call
+                    p_print(yellow("Archive: skip "+fn+", which was truncated."))
+                    del changed[fn]
+                    continue
+                tarinfo.size = entry["size"]
+                tar.addfile(tarinfo,f)
+
+    def wait(self):
+        """
+        wait for the running archive job and raise its errors
+        """
+        if self.future:
+            future, self.future = self.future, None
+            future.result()
+
+    def read_manifest(self):
+        try:
+            with open(self.manifest_file) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def write_manifest(self,manifest):
+        with open(self.manifest_file+".tmp",'w') as f:
+            json.dump(manifest,f)
+        os.replace(self.manifest_file+".tmp",self.manifest_file)
+
+
+def file_hash(fn):
+    h = hashlib.sha1()
+    with open(fn,'rb') as f:
+        for block in iter(lambda: f.read(1<<20),b""):
+            h.update(block)
+    return h.hexdigest()
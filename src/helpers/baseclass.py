@@ -1,4 +1,9 @@
 import copy
+import os
+import re
+import sys
+import glob
+import importlib
 import inflection
 
 from helpers.printtools import *
@@ -26,8 +31,24 @@ class BaseClass():
         """
 
         p_print("  Setup class "+yellow(self.__class__.__name__))
+        attributes=self.check_prms(input_prm_dict,*further_classes)
+
+        # convert dict to class attributes
+        for prm_name,prm_value in attributes.items():
+            if "time" in prm_name.lower(): 
+                prm_value=parse_time_to_seconds(prm_value)
+            setattr(self,prm_name,prm_value)
+        self.prm_names = list(attributes)
+
+    @classmethod
+    def check_prms(cls,input_prm_dict,*further_classes):
+        """
+        Compares user input against the defaults of the class. 
+        Throws errors for invalid input, else returns the dict of 
+        parameters including the defaults.
+        """
         # initialize attribute dict with default values
-        attributes=self.defaults(*further_classes)
+        attributes=cls.defaults(*further_classes)
 
         # overwrite defaults with custom input prms
         for input_prm_name,input_value in input_prm_dict.items():
@@ -41,15 +62,27 @@ class BaseClass():
         # check if all mandatory input prms are set
         for prm_name,prm_value in attributes.items():
             if prm_value == "NODEFAULT":
-                print(self.__class__.__name__)
+                print(cls.__name__)
                 raise InputPrmError("'"+prm_name+"' is not set in parameter"
                                     "file and has no default value!")
+        return attributes
 
-        # convert dict to class attributes
-        for prm_name,prm_value in attributes.items():
-            if "time" in prm_name.lower(): 
-                prm_value=parse_time_to_seconds(prm_value)
-            setattr(self,prm_name,prm_value)
+    def changed_prms(self,other):
+        """
+        names of the input parameters which differ between this object
+        and another one of the same class (e.g. set up from a changed 
+        parameter file)
+        """
+        return [p for p in other.prm_names 
+                if p != "_type" and getattr(self,p,None) != getattr(other,p)]
+
+    def update_prms(self,other):
+        """
+        copy the input parameters of another object of the same class
+        """
+        for prm_name in other.prm_names: 
+            setattr(self,prm_name,getattr(other,prm_name))
+        self.prm_names = other.prm_names
 
     @classmethod
     def create(cls,class_dict,*args):
@@ -66,7 +99,27 @@ class BaseClass():
     @classmethod
     def subclass(cls,string):
         """
-        choose subclass of a class by string
+        choose subclass of a class by string. 
+        The subclasses are loaded lazily: if the subclass is not found
+        among the ones imported so far, the modules of the package
+        which define the class name are imported.
+        """
+        subclass = cls.find_subclass(string)
+        if not subclass: 
+            for module in modules_by_cname(cls.__module__,string):
+                importlib.import_module(module)
+                subclass = cls.find_subclass(string)
+                if subclass: 
+                    break
+        if not subclass: 
+            raise InputPrmError(
+                "'{}' is not a valid {}".format(string,cls.__name__))
+        return subclass
+
+    @classmethod
+    def find_subclass(cls,string):
+        """
+        get subclass with the given class name among the imported ones
         """
         coll = []
         for sc in cls.__subclasses__():
@@ -74,9 +127,7 @@ class BaseClass():
         for subclass in coll: 
             if string == subclass.cname:
                 return subclass
-        print(coll)
-        raise InputPrmError(
-            "'{}' is not a valid {}".format(string,cls.__name__))
+        return None
 
     @classmethod
     def recursive_subclasses(cls,collection,subclass): 
@@ -130,5 +181,28 @@ class BaseClass():
         # """
         # return inflection.underscore(cls.__name__)
 
-class InputPrmError(Exception):
-    pass
+# Index of the modules of each package by the class names (cname) 
+# defined in them. The modules are only scanned as text, such that
+# solvers, machines etc. and their dependencies are only imported once
+# they are used.
+cname_index = {}
+
+def modules_by_cname(module_name,cname):
+    """
+    modules in the package of the given module, which define a class 
+    with the given cname
+    """
+    package = module_name.rpartition(".")[0]
+    if not package: 
+        return []
+    if package not in cname_index: 
+        cname_index[package] = {}
+        directory = os.path.dirname(sys.modules[module_name].__file__)
+        for f in sorted(glob.glob(os.path.join(directory,"*.py"))):
+            name = os.path.basename(f)[:-3]
+            if name == "__init__":
+                continue
+            with open(f) as stream: 
+                for c in re.findall(r"^\s*cname\s*=\s*[\"'](\w+)[\"']",stream.read(),re.M):
+                    cname_index[package].setdefault(c,[]).append(package+"."+name)
+    return cname_index[package].get(cname,[])
@@ -0,0 +1,173 @@
+import os
+import glob
+import sqlite3
+import hashlib
+import json
+import time
+import contextlib
+from collections import OrderedDict
+import numpy as np
+
+from .printtools import *
+
+
+class EvaluationCache():
+    """
+    Persistent cache of sample evaluations.
+    Each entry is keyed by a hash of the solver configuration and the
+    sample node and holds the outputs of the evaluation (a dict of
+    JSON-serializable values).
+    Entries are stored in an SQLite file. If a maximum number of entries
+    is given, the least recently used entries are removed.
+    A connection is only opened for each access, so that the cache can
+    be pickled along with the simulation.
+    """
+
+    def __init__(self,filename,max_entries=None):
+        self.filename = filename
+        self.max_entries = max_entries
+        with self.connect() as con:
+            con.execute("CREATE TABLE IF NOT EXISTS evaluations ("
+                        "key TEXT PRIMARY KEY, outputs TEXT, last_access REAL)")
+            con.execute("CREATE INDEX IF NOT EXISTS i_access ON evaluations (last_access)")
+
+    @contextlib.contextmanager
+    def connect(self):
+        con = sqlite3.connect(self.filename,timeout=60.)
+        try:
+            with con:
+                yield con
+        finally:
+            con.close()
+
+    @staticmethod
+    def keys(config,nodes):
+        """
+        hash of the configuration dict and the node vector for each
+        of the given nodes
+        """
+        config_str = json.dumps(config,sort_keys=True,default=str).encode()
+        nodes = np.ascontiguousarray(nodes,dtype=np.float64)
+        return [hashlib.sha256(config_str+node.tobytes()).hexdigest() for node in nodes]
+
+    def get(self,keys):
+        """
+        get the outputs of all cached entries among the given keys
+        """
+        found = {}
+        with self.connect() as con:
+            for i in range(0,len(keys),500):
+                chunk = keys[i:i+500]
+                rows = con.execute("SELECT key, outputs FROM evaluations WHERE key IN ({})".format(
+                                   ",".join("?"*len(chunk))),chunk).fetchall()
+                found.update({k:json.loads(o) for k,o in rows})
+            now = time.time()
+            con.executemany("UPDATE evaluations SET last_access=? WHERE key=?",
+                            [(now,k) for k in found])
+        return found
+
+    def put(self,entries):
+        """
+        add entries (dict of key and outputs) to the cache and evict
+        least recently used entries
+        """
+        now = time.time()
+        with self.connect() as con:
+            con.executemany("INSERT OR REPLACE INTO evaluations VALUES (?,?,?)",
+                            [(k,json.dumps(o),now) for k,o in entries.items()])
+            if self.max_entries:
+                con.execute("DELETE FROM evaluations WHERE key IN (SELECT key FROM evaluations "
+                            "ORDER BY last_access DESC LIMIT -1 OFFSET ?)",(self.max_entries,))
+
+    def __len__(self):
+        with self.connect() as con:
+            return con.execute("SELECT COUNT(*) FROM evaluations").fetchone()[0]
+
+
+class QuadratureCache():
+    """
+    Cache of quadrature rules in memory and optionally on disk.
+    Each rule is keyed by a hash of its description (e.g. distributions
+    with their parameters, polynomial degree, rule and sparse grid).
+    On disk, nodes and weights are stored as .npy files in a directory
+    and loaded memory-mapped. If a maximum size (in MB) is given, the 
+    least recently used rules are removed from the directory. 
+    In memory, the last max_memory_entries rules are kept for all 
+    instances (e.g. for parameter sweeps in one process).
+    """
+
+    memory = OrderedDict()
+    max_memory_entries = 16
+
+    def __init__(self,dirname=None,max_mb=None):
+        self.dirname = dirname
+        self.max_mb = max_mb
+
+    @staticmethod
+    def key(description):
+        return hashlib.sha256(json.dumps(description,sort_keys=True,default=str).encode()).hexdigest()
+
+    def get(self,description,build):
+        """
+        get nodes and weights of the described rule. If it is not 
+        cached, it is built by the given function and cached.
+        """
+        key = self.key(description)
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            return self.memory[key]
+        rule = self.load(key) if self.dirname else None
+        if rule is None:
+            rule = build()
+            # the cached arrays are shared
+            for array in rule:
+                array.flags.writeable = False
+            if self.dirname:
+                self.save(key,*rule)
+        self.memory[key] = rule
+        while len(self.memory) > self.max_memory_entries:
+            self.memory.popitem(last=False)
+        return rule
+
+    def files(self,key):
+        return [os.path.join(self.dirname,key+"_"+name+".npy") for name in ["nodes","weights"]]
+
+    def load(self,key):
+        files = self.files(key)
+        try:
+            rule = tuple(np.load(f,mmap_mode="r") for f in files)
+        except FileNotFoundError:
+            return None
+        # mark as recently used
+        for f in files:
+            os.utime(f)
+        p_print("Quadrature rule loaded from cache "+yellow(self.dirname))
+        return rule
+
+    def save(self,key,*arrays):
+        os.makedirs(self.dirname,exist_ok=True)
+        for f, array in zip(self.files(key),arrays):
+            with open(f+".tmp",'wb') as stream:
+                np.save(stream,array)
+            os.replace(f+".tmp",f)
+        if self.max_mb:
+            self.evict()
+
+    def evict(self):
+        """
+        remove least recently used rules until the total size of the 
+        directory is below the maximum
+        """
+        rules = {}
+        for f in glob.glob(os.path.join(self.dirname,"*_nodes.npy")):
+            key = os.path.basename(f)[:-len("_nodes.npy")]
+            files = [g for g in self.files(key) if os.path.exists(g)]
+            rules[key] = (max(os.path.getmtime(g) for g in files), 
+                          sum(os.path.getsize(g) for g in files), files)
+        size = sum(r[1] for r in rules.values())
+        for key in sorted(rules,key=lambda k: rules[k][0]):
+            if size <= self.max_mb*1.E6:
+                break
+            for f in rules[key][2]:
+                os.remove(f)
+            size -= rules[key][1]
@@ -0,0 +1,343 @@
+import pickle
+import hashlib
+import struct
+import uuid
+import io
+import os
+import atexit
+import threading
+import weakref
+import numpy as np
+
+from .printtools import *
+
+
+class Checkpoint():
+    """
+    Append-only checkpoint journal of the simulation state.
+    After each step, the simulation object is pickled and appended to
+    the journal as a new record. Large NumPy arrays are not pickled
+    with the object graph but written to separate .npy files, and the
+    records only contain the (light) remaining object graph with
+    references to them. 
+    An array is journaled once: it is then made read-only (with the 
+    arrays it is a view of) and tracked by its identity, such that the 
+    following records only refer to its file. Hence, only new arrays 
+    are written, and arrays are neither hashed nor copied. Code which 
+    changes arrays in place has to copy them first (see SampleStore).
+    Each record starts with its length and a checksum, such that an
+    incomplete last record (e.g. after a crash) is detected and the
+    previous one is used on restart. It contains the info given to 
+    write, the keys of all arrays it refers to and the simulation.
+    The object graph is pickled in the calling thread, which gives a
+    consistent snapshot. The files are then written by a background 
+    thread. If several records are written before the thread is done,
+    only the latest one is added to the journal. Call flush to wait 
+    until everything is written.
+    On restart, the arrays are memory-mapped (read-only) instead of
+    being read, i.e. they are only loaded once they are accessed. 
+    The journal is compacted after each iteration (see compact), and
+    array files which no remaining record refers to are removed.
+    """
+
+    magic = b"PCKR"
+    header = struct.Struct("<4sQ32s")
+
+    def __init__(self,dirname="checkpoint",min_array_bytes=65536):
+        self.dirname = dirname
+        self.min_array_bytes = min_array_bytes
+        self.journal_file = os.path.join(dirname,"journal")
+        self.array_dir = os.path.join(dirname,"arrays")
+        # journaled (read-only) arrays: id -> (key, weak reference)
+        self.tracked = {}
+        self.pending_arrays = {}
+        self.pending_record = None
+        self.busy = False
+        self.error = None
+        self.writer = None
+        self.tail_checked = False
+        self.cond = threading.Condition()
+
+    def reset(self):
+        """
+        start a new journal and remove the array files of the old one
+        """
+        self.flush()
+        if os.path.isfile(self.journal_file):
+            os.remove(self.journal_file)
+        self.prune_arrays(set())
+
+    def compact(self):
+        """
+        Rewrite the journal with only the last record of each iteration
+        (and thus the latest record), then remove the array files which
+        are not referenced by these records anymore.
+        """
+        records = self.read_records()
+        if not records:
+            return
+        with open(self.journal_file,'rb') as f:
+            payloads = []
+            for start, length, digest in records:
+                f.seek(start)
+                payloads.append(f.read(length))
+        # info of each record: (iteration number, number of finished steps)
+        iterations = [(self.record_info(payload)[0] or (None,))[0] for payload in payloads]
+        keep = [i for i, n_iter in enumerate(iterations) if n_iter not in iterations[i+1:]]
+        if len(keep) < len(records):
+            tmp_file = self.journal_file+".tmp"
+            with open(tmp_file,'wb') as f:
+                for i in keep:
+                    f.write(self.header.pack(self.magic,len(payloads[i]),records[i][2]))
+                    f.write(payloads[i])
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_file,self.journal_file)
+        self.prune_arrays(set().union(*[self.record_info(payloads[i])[1] for i in keep]))
+
+    @staticmethod
+    def record_info(payload):
+        """
+        info of a record and the keys of the arrays it refers to,
+        without loading the simulation
+        """
+        stream = io.BytesIO(payload)
+        return pickle.load(stream), pickle.load(stream)
+
+    def prune_arrays(self,keep):
+        """
+        remove all array files except those with the given keys
+        """
+        if not os.path.isdir(self.array_dir):
+            return
+        for fn in os.listdir(self.array_dir):
+            key = fn.split(".")[0]
+            if key not in keep:
+                os.remove(os.path.join(self.array_dir,fn))
+        self.tracked = {i:t for i,t in self.tracked.items() if t[0] in keep and t[1]() is not None}
+
+    def array_file(self,key):
+        return os.path.join(self.array_dir,key+".npy")
+
+    def write(self,sim,info=None):
+        """
+        append the state of the simulation as a new record. The object 
+        graph is pickled here (without the lock of the writer), as this
+        is the snapshot; only the file I/O is done in the background.
+        """
+        self.raise_error()
+        buffer = io.BytesIO()
+        pickler = ArrayPickler(buffer,self)
+        pickler.dump(sim)
+        # info and keys are pickled separately, such that they can be 
+        # read without loading the simulation
+        record = pickle.dumps(info,pickle.HIGHEST_PROTOCOL) \
+               + pickle.dumps(pickler.keys,pickle.HIGHEST_PROTOCOL) + buffer.getvalue()
+        with self.cond:
+            self.pending_arrays.update(pickler.new_arrays)
+            self.pending_record = record
+            self.cond.notify_all()
+        if not self.writer:
+            self.writer = threading.Thread(target=self.write_loop,daemon=True)
+            self.writer.start()
+            atexit.register(self.flush)
+
+    def track_array(self,arr):
+        """
+        get the key of a journaled array. New arrays and arrays which 
+        were made writeable again get a new key and are made read-only, 
+        such that they can be written in the background. 
+        Returns key and whether the array is new.
+        """
+        tracked = self.tracked.get(id(arr))
+        if tracked is not None and tracked[1]() is arr and not arr.flags.writeable:
+            return tracked[0], False
+        key = uuid.uuid4().hex
+        base = arr
+        while isinstance(base,np.ndarray):
+            # views are frozen with the array they are a view of
+            base.flags.writeable = False
+            base = base.base
+        self.tracked[id(arr)] = (key,weakref.ref(arr))
+        return key, True
+
+    def write_loop(self):
+        """
+        background thread: write pending arrays and records
+        """
+        while True:
+            with self.cond:
+                self.busy = False
+                self.cond.notify_all()
+                while not self.pending_arrays and self.pending_record is None:
+                    self.cond.wait()
+                arrays, self.pending_arrays = self.pending_arrays, {}
+                record, self.pending_record = self.pending_record, None
+                self.busy = True
+            try:
+                # arrays first, such that a record is only found once
+                # all its arrays exist
+                for key, arr in arrays.items():
+                    self.store_array(key,arr)
+                if record is not None:
+                    self.append_record(record)
+            except Exception as e:
+                self.error = e
+
+    def truncate_tail(self):
+        """
+        Remove an incomplete last record (e.g. after a crash), such 
+        that new records can be appended to the journal.
+        """
+        self.tail_checked = True
+        if not os.path.isfile(self.journal_file):
+            return
+        records = self.scan_records()
+        with open(self.journal_file,'r+b') as f:
+            if records:
+                start, length, digest = records[-1]
+                f.seek(start)
+                if hashlib.sha256(f.read(length)).digest() != digest:
+                    records.pop()
+            end = records[-1][0]+records[-1][1] if records else 0
+            f.truncate(end)
+
+    def flush(self):
+        """
+        wait until all records are written. Errors of the background 
+        thread are raised here.
+        """
+        with self.cond:
+            while self.busy or self.pending_arrays or self.pending_record is not None:
+                self.cond.wait()
+        self.raise_error()
+
+    def raise_error(self):
+        if self.error:
+            error, self.error = self.error, None
+            raise Exception("Writing the checkpoint failed.") from error
+
+    def store_array(self,key,arr):
+        """
+        write array to an .npy file named by its key (content hash),
+        if it does not exist yet.
+        """
+        os.makedirs(self.array_dir,exist_ok=True)
+        fn = self.array_file(key)
+        if not os.path.isfile(fn):
+            # write to temporary file first, such that only
+            # complete arrays are found
+            with open(fn+".tmp",'wb') as f:
+                np.save(f,arr)
+            os.replace(fn+".tmp",fn)
+
+    def append_record(self,payload):
+        os.makedirs(self.dirname,exist_ok=True)
+        if not self.tail_checked:
+            self.truncate_tail()
+        with open(self.journal_file,'ab') as f:
+            f.write(self.header.pack(self.magic,len(payload),hashlib.sha256(payload).digest()))
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def read_records(self):
+        """
+        get (start, length, checksum) of all records in the journal. 
+        Only the headers are read, the records are checked once they 
+        are loaded.
+        """
+        self.flush()
+        return self.scan_records()
+
+    def scan_records(self):
+        records = []
+        if not os.path.isfile(self.journal_file):
+            return records
+        size = os.path.getsize(self.journal_file)
+        with open(self.journal_file,'rb') as f:
+            while True:
+                head = f.read(self.header.size)
+                if len(head) < self.header.size:
+                    break
+                magic, length, digest = self.header.unpack(head)
+                start = f.tell()
+                if magic != self.magic or start+length > size:
+                    break
+                records.append((start,length,digest))
+                f.seek(length,os.SEEK_CUR)
+        return records
+
+    def __len__(self):
+        return len(self.read_records())
+
+    def load(self,i_record=-1):
+        """
+        Restore the simulation from a record of the journal. By default,
+        the last complete one is used: if the last record is incomplete 
+        (e.g. after a crash during writing), the previous one is taken.
+        Returns info and simulation.
+        """
+        records = self.read_records()
+        if not records:
+            raise Exception("No checkpoint found in "+self.journal_file+".")
+        i_record = i_record % len(records)
+        with open(self.journal_file,'rb') as f:
+            while True:
+                start, length, digest = records[i_record]
+                f.seek(start)
+                payload = f.read(length)
+                if hashlib.sha256(payload).digest() == digest:
+                    break
+                p_print(red("Warning: ")+"incomplete record in checkpoint journal "
+                        +yellow(self.journal_file)+" is ignored.")
+                if i_record != len(records)-1 or i_record == 0:
+                    raise Exception("Record "+str(i_record)+" of checkpoint is corrupted.")
+                i_record -= 1
+        stream = io.BytesIO(payload)
+        info, keys = pickle.load(stream), pickle.load(stream)
+        return info, ArrayUnpickler(stream,self).load()
+
+
+class ArrayPickler(pickle.Pickler):
+    """
+    Pickler, which stores large arrays in the array files of the
+    checkpoint and only pickles a reference to them.
+    """
+
+    def __init__(self,file,checkpoint):
+        super().__init__(file,pickle.HIGHEST_PROTOCOL)
+        self.checkpoint = checkpoint
+        # keys of all referenced arrays and the arrays to be written
+        self.keys = set()
+        self.new_arrays = {}
+
+    def persistent_id(self,obj):
+        # memory-mapped arrays (from a restart) are included
+        if isinstance(obj,np.ndarray) and not obj.dtype.hasobject \
+                and obj.nbytes >= self.checkpoint.min_array_bytes:
+            key, new = self.checkpoint.track_array(obj)
+            if new:
+                self.new_arrays[key] = obj
+            self.keys.add(key)
+            return ("npy",key)
+        return None
+
+
+class ArrayUnpickler(pickle.Unpickler):
+
+    def __init__(self,file,checkpoint):
+        super().__init__(file)
+        self.checkpoint = checkpoint
+        self.arrays = {}
+
+    def persistent_load(self,pid):
+        kind, key = pid
+        if kind != "npy":
+            raise pickle.UnpicklingError("unknown reference "+str(pid))
+        if key not in self.arrays:
+            # read-only, such that the array file stays valid for it
+            arr = np.load(self.checkpoint.array_file(key),mmap_mode='r')
+            self.arrays[key] = arr
+            self.checkpoint.tracked[id(arr)] = (key,weakref.ref(arr))
+        return self.arrays[key]
@@ -1,18 +1,19 @@
 # ---------- external imports ----------
 import yaml
-import pickle
 import sys
 import re
 # ---------- local imports -------------
 from uqmethod.uqmethod import UqMethod
 from machine.machine import Machine
+from solver.solver import Solver
+from stochvar.stochvar import StochVar
 from helpers.baseclass import BaseClass
 from helpers.printtools import *
 from helpers.tools import *
 from helpers import globels
 
 
-def config(prmfile):
+def config(prmfile,new_checkpoint=True):
     """
     Reads all user input and sets up (sub-)classes according to this
     input.
@@ -48,7 +49,7 @@ def config(prmfile):
     for stage in sim.cfg.main_stages: 
         m_str = stage["machine"] if "machine" in stage else "default"
         m = copy.deepcopy(sim.machines[m_str])
-        m.fill(stage["name"],True)
+        m.fill(stage["name"],True,stage.get("pipeline",False))
         sim.stages.append(m)
 
     # in the multilevel case, some further setup is needed for the
@@ -56,18 +57,117 @@ def config(prmfile):
     sim.setup(prms)
 
     globels.sim = sim
+    if new_checkpoint: 
+        globels.checkpoint.reset()
     return sim
 
+def check(prmfile):
+    """
+    Validate the parameter file against the defaults of the chosen
+    classes without setting up the simulation. Only the modules of the
+    chosen classes are imported, no solvers or machines are 
+    initialized. All errors are listed, then an exception is raised.
+    """
+    with open(prmfile, 'r') as f:
+        prms = yaml.safe_load(f)
+    print_step("Check parameter file "+prmfile)
+
+    errors = []
+    def check_section(name,ClassLoc,prms_loc,*further_classes): 
+        try: 
+            ClassLoc.check_prms(prms_loc,*further_classes)
+            p_print("  "+name+": "+yellow(ClassLoc.__name__)+" "+green("OK"))
+        except (InputPrmError,KeyError) as e: 
+            errors.append(name+": "+str(e))
+            p_print("  "+name+": "+red(str(e)))
+
+    def get_class(name,lookup,*args): 
+        try: 
+            return lookup(*args)
+        except (InputPrmError,KeyError) as e: 
+            errors.append(name+": "+str(e))
+            p_print("  "+name+": "+red(str(e)))
+
+    for section in ["general","uq_method","stoch_vars","qois"]: 
+        if section not in prms: 
+            errors.append("Required section '"+section+"' is missing.")
+    if errors: 
+        raise InputPrmError("\n".join(errors))
+
+    UqLoc = get_class("uq_method",UqMethod.subclass,prms["uq_method"].get("_type"))
+    if not UqLoc: 
+        raise InputPrmError("\n".join(errors))
+    check_section("uq_method",UqLoc,prms["uq_method"])
+    check_section("general",GeneralConfig,prms["general"])
+    if "sampling" in prms: 
+        SamplingLoc = get_class("sampling",UqLoc.SamplingMethod.chosen,prms["sampling"])
+        if SamplingLoc: 
+            check_section("sampling",SamplingLoc,prms["sampling"])
+
+    machines = prms["machines"] if "machines" in prms else [dict(prms.get("machine",{}),name="default")]
+    machine_classes = {}
+    for i, subdict in enumerate(machines): 
+        MachineLoc = get_class("machines "+str(i+1),Machine.subclass,subdict.get("_type"))
+        if MachineLoc: 
+            check_section("machines "+str(i+1),MachineLoc,subdict)
+            machine_classes[subdict.get("name","default")] = MachineLoc
+    if "machine_postproc" in prms: 
+        check_section("machine_postproc",Machine.subclass("local"),prms["machine_postproc"])
+
+    # solvers are checked for each main stage
+    stages = GeneralConfig.check_prms(prms["general"])["main_stages"]
+    solver_section, sub_list = UqLoc.solver_section, UqLoc.solver_sub_list
+    if solver_section not in prms: 
+        errors.append("Required section '"+solver_section+"' is missing.")
+        raise InputPrmError("\n".join(errors))
+    solvers = expand_prms_by_sublist(prms[solver_section],sub_list) if sub_list \
+              else [prms[solver_section]]
+    solver_classes = []
+    for i_stage, stage in enumerate(stages): 
+        MachineLoc = machine_classes.get(stage.get("machine","default"),Machine)
+        for i, subdict in enumerate(solvers): 
+            if "stages" in subdict: 
+                subdict = expand_prms_by_sublist(subdict,"stages")[i_stage]
+            name = "{} {} (stage {})".format(solver_section,i+1,stage["name"])
+            SolverLoc = get_class(name,Solver.subclass_by_stage,subdict.get("_type"),stage["name"])
+            if SolverLoc: 
+                check_section(name,SolverLoc,subdict,UqLoc,MachineLoc)
+                solver_classes.append(SolverLoc)
+
+    for i, subdict in enumerate(prms["stoch_vars"]): 
+        StochVarLoc = get_class("stoch_vars "+str(i+1),StochVar.subclass,subdict.get("_type"))
+        if StochVarLoc: 
+            check_section("stoch_vars "+str(i+1),StochVarLoc,subdict,*solver_classes)
+
+    for SolverLoc in dict.fromkeys(solver_classes): 
+        for i, subdict in enumerate(prms["qois"]): 
+            QoILoc = get_class("qois "+str(i+1),SolverLoc.QoI.subclass_by_stage,subdict.get("_type"),
+                               "iteration_postproc")
+            if QoILoc: 
+                check_section("qois "+str(i+1),QoILoc,subdict,UqLoc)
+
+    if errors: 
+        raise InputPrmError("Parameter file "+prmfile+" is invalid:\n"+"\n".join(errors))
+    p_print(green("Parameter file "+prmfile+" is valid."))
+
+
 def restart(prmfile=None):
     """
-    restart simulation from a pickle file. 
+    restart simulation from the last record in the checkpoint journal.
+    If a parameter file is given, the simulation is set up from it and
+    compared to the restored one. The changes are applied to the 
+    restored simulation, which keeps its finished samples (see the 
+    apply_prm_changes routines of the UQ methods).
     """
-    with open('pounce.pickle', 'rb') as f:
-        sim = pickle.load(f)
+    (n_iter, n_steps), sim = globels.checkpoint.load()
+    p_print("Restart from checkpoint after step {} of iteration {}.".format(n_steps,n_iter))
     if prmfile:
-        raise Exception("Restart with changed parameter file not yet implemented."
-                        " Please use the apply_changes function in helpers/config.py"
-                        " to manually apply changes to the simulation setup.")
+        print_major_section("Apply changed parameter file "+prmfile)
+        new = config(prmfile,new_checkpoint=False)
+        if new.cname != sim.cname: 
+            raise InputPrmError("The UQ method cannot be changed on restart.")
+        globels.sim = sim
+        sim.apply_prm_changes(new)
 
     n_finished_iter = len(sim.iterations) \
                     - (0 if sim.current_iter.finished else 1)
@@ -80,7 +180,7 @@ def restart(prmfile=None):
     # extract_mfmc_mlopt()
     # extract_mlmc_mlopt()
 
-    if sim.cfg.stdout_log_file: 
+    if sim.cfg.stdout_log_file and not isinstance(sys.stdout,Logger): 
         sys.stdout = Logger(sim.cfg.stdout_log_file)
 
     return sim
@@ -251,7 +351,7 @@ class GeneralConfig(BaseClass):
     """
 
     defaults_ = {
-        "archive_level" : 0,
+        "archive_level" : 0, # 1: archive files, 2: including checkpoint
         "do_pickle" : True,
         "project_name" : "NODEFAULT",
         "stdout_log_file": None,
@@ -1,8 +1,6 @@
-import pickle
-import os
-import tarfile
-import glob
 from .printtools import *
+from .checkpoint import Checkpoint
+from .archive import Archiver
 
 
 # These are place holders and overwritten during config
@@ -10,19 +8,19 @@ sim=None
 archive_level=None
 project_name=None
 do_pickle=None
+checkpoint=Checkpoint()
+archiver=Archiver()
 
 
 def update_step(string=None):
+    """
+    Mark step as finished and append the current state of the 
+    simulation to the checkpoint journal.
+    """
     if string:
         sim.current_iter.finished_steps.append(string)
     if do_pickle: 
-        if not os.path.isdir('pickle'): 
-            os.mkdir('pickle')
-        fn_step = "pickle/I{}_S{}.pickle".format(sim.current_iter.n,
-                                                 len(sim.current_iter.finished_steps))
-        for fn in [sim.filename, fn_step]: 
-            with open(fn, 'wb') as f:
-                pickle.dump(sim, f, 2)
+        checkpoint.write(sim,(sim.current_iter.n,len(sim.current_iter.finished_steps)))
 
 
 def run_step(description, func, *args, **kwargs):
@@ -38,34 +36,28 @@ def iteration(wrapped_function):
         wrapped_function(self)
         archive()
         self.current_iter.finished = True
+        checkpoint.flush()
+        if do_pickle: 
+            checkpoint.compact()
     return iteration_wrapper
 
 
 def archive(): 
+    """
+    Archive new and changed files of the working directory. 
+    The step is marked as finished (and checkpointed) before the 
+    files are selected. This prevents simulations restarted from 
+    the archive from instantly archiving the very same data again.
+    The checkpoint is only archived with archive_level 2, since it
+    is rewritten in every iteration.
+    """
     if archive_level == 0: 
         return
     description="Archive"
-    run_step(description,archive_loc)
-
-    # mark archiving as done. Pickle new state and add to archive.
-    # This prevents simulations restarted from archive from
-    # instantly archiving the very same data again.
-    if description not in sim.current_iter.finished_steps:
-        archive_name = 'archive/%s.tar.gz'%(sim.current_iter.name.replace(" ","_"))
-        with tarfile.open(archive_name, "r+:gz") as tar:
-            tar.add(sim.pickle_file)
-
-
-def archive_loc():
-    if not os.path.isdir('archive'): 
-        os.mkdir('archive')
-    archive_name = 'archive/%s.tar.gz'%(sim.current_iter.name.replace(" ","_"))
-    files = glob.glob('*')
-    p_print("Write to file "+yellow(archive_name))
-    with tarfile.open(archive_name, "w:gz") as tar:
-        for fn in files: 
-            if fn not in [sim.pickle_file, 'archive'] \
-                    and not os.path.islink(fn):
-                tar.add(fn)
-
-
+    if description in sim.current_iter.finished_steps:
+        return
+    print_step(description+":")
+    update_step(string=description)
+    checkpoint.flush()
+    exclude = () if archive_level > 1 else (checkpoint.dirname,)
+    archiver.archive(sim.current_iter.name.replace(" ","_"),exclude)
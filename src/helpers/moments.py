@@ -0,0 +1,75 @@
+import numpy as np
+
+
+class StreamingMoments():
+    """
+    Count, mean and sums of the central powers (m2, m3, m4) of a stream
+    of samples, which can be scalar or field-valued (one sample per
+    row). Each batch of samples is reduced with NumPy and merged into
+    the former state with the pairwise formulas of Chan et al., which
+    are numerically stable also for many samples with large mean.
+    """
+
+    def __init__(self,order=4):
+        self.order = order
+        self.n = 0
+        self.mean = 0.
+        self.m2 = 0.
+        self.m3 = 0.
+        self.m4 = 0.
+
+    @classmethod
+    def from_sums(cls,n,s1,s2,s3=None,s4=None):
+        """
+        state from the sums of the powers of the samples
+        (e.g. of older simulations)
+        """
+        moments = cls(4 if s4 is not None else 2)
+        if n == 0:
+            return moments
+        mean = s1/n
+        moments.n, moments.mean = n, mean
+        moments.m2 = s2 - n*mean**2
+        if s4 is not None:
+            moments.m3 = s3 - 3.*mean*s2 + 2.*n*mean**3
+            moments.m4 = s4 - 4.*mean*s3 + 6.*mean**2*s2 - 3.*n*mean**4
+        return moments
+
+    def update(self,x):
+        """
+        add a batch of samples
+        """
+        x = np.asarray(x,dtype=float)
+        if len(x) == 0:
+            return
+        mean = np.mean(x,axis=0)
+        d = x - mean
+        d2 = d**2
+        m2 = np.sum(d2,axis=0)
+        m3 = np.sum(d2*d,axis=0) if self.order > 2 else 0.
+        m4 = np.sum(d2**2,axis=0) if self.order > 2 else 0.
+        self.merge(len(x),mean,m2,m3,m4)
+
+    def merge(self,n_b,mean_b,m2_b,m3_b=0.,m4_b=0.):
+        """
+        merge the state of another set of samples
+        """
+        n_a = self.n
+        n = n_a + n_b
+        delta = mean_b - self.mean
+        mean = self.mean + delta*n_b/n
+        m2 = self.m2 + m2_b + delta**2*n_a*n_b/n
+        if self.order > 2:
+            self.m4 = self.m4 + m4_b + delta**4*n_a*n_b*(n_a**2-n_a*n_b+n_b**2)/n**3 \
+                    + 6.*delta**2*(n_a**2*m2_b+n_b**2*self.m2)/n**2 \
+                    + 4.*delta*(n_a*m3_b-n_b*self.m3)/n
+            self.m3 = self.m3 + m3_b + delta**3*n_a*n_b*(n_a-n_b)/n**2 \
+                    + 3.*delta*(n_a*m2_b-n_b*self.m2)/n
+        self.n, self.mean, self.m2 = n, mean, m2
+
+    @property
+    def var(self):
+        """
+        unbiased sample variance
+        """
+        return self.m2/(self.n-1.)
@@ -29,6 +29,14 @@ class Empty():
     pass
 
 
+def antithetic_means(u):
+    """
+    means of antithetic pairs, which are consecutive samples
+    """
+    u = np.asarray(u)
+    return 0.5*(u[0::2]+u[1::2])
+
+
 def parse_time_to_seconds(arg): 
     """
     parse different formats to give time in the yml parameter file.
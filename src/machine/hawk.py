@@ -12,6 +12,7 @@ from .machine import Machine
 from helpers.printtools import *
 from helpers.tools import *
 from .local import Local
+from .remote import run_remote
 from helpers import globels
 
 class Hawk(Machine):
@@ -21,13 +22,20 @@ class Hawk(Machine):
 
     cname = "hawk"
 
+    cores_per_node = 128
+
     defaults_={
         "parallelization" : "mpi", # change default (options: "none", "mpi", "gnu")
         "work_safety_fac" : 1.5,
         "n_max_nodes" : 1024,
         "max_walltime" : 86400, # 24h
         "max_total_work" : 36e5, # 1.000 CoreH
-        "remote" : False
+        "remote" : False,
+        "remote_shell" : None, # command which starts a shell on the remote machine; default: "ssh -T <host> bash"
+        "poll_interval_min" : 1., # status files are polled with increasing interval (in s)
+        "poll_interval_max" : 60., 
+        "qstat_interval" : 300., # queue status is only read occasionally (in s)
+        "errfile_timeout" : 60. # max. wait for the error file of a finished job (in s)
         }
 
     defaults_add = { 
@@ -47,11 +55,10 @@ class Hawk(Machine):
     def __init__(self,class_dict):
         """
         check if POUNCE is run on Hawk or locally on a mounted
-        directory. In the latter case, ssh is used to submit jobs
-        and supervise the queuing status.
+        directory. In the latter case, jobs are submitted and 
+        supervised via one persistent ssh connection (see remote.py).
         """
         super().__init__(class_dict)
-        self.cores_per_node = 128
         self.total_work = 0.
         # self.remote = not socket.gethostname().startswith('hawk-login')
         if self.remote: 
@@ -59,11 +66,21 @@ class Hawk(Machine):
             job = subprocess.run(args,stdout=subprocess.PIPE,
                                  universal_newlines=True)
             line = job.stdout.split('\n')[1]
-            self.ssh_command = line.split(":")[0]
-            mount_dir_on_hawk = line.split()[0].split(":")[1]
-            mount_dir_local = line.split()[-1]
             cwd = os.getcwd()
-            self.dir_on_hawk=mount_dir_on_hawk+cwd.replace(mount_dir_local,"")
+            if ":" in line.split()[0]: 
+                self.ssh_command = line.split(":")[0]
+                mount_dir_on_hawk = line.split()[0].split(":")[1]
+                mount_dir_local = line.split()[-1]
+                self.dir_on_hawk=mount_dir_on_hawk+cwd.replace(mount_dir_local,"")
+            else: 
+                # not a mounted directory (e.g. with a local remote_shell for testing)
+                self.ssh_command = None
+                self.dir_on_hawk = cwd
+            if not self.remote_shell: 
+                if not self.ssh_command: 
+                    raise InputPrmError("Working directory is not mounted from a remote machine. "
+                                        "Set remote_shell.")
+                self.remote_shell = "ssh -T "+self.ssh_command+" bash"
 
 
     def run_batches(self):
@@ -120,8 +137,10 @@ class Hawk(Machine):
         if not resub: 
             self.prepare_run_commands(batch)
 
+        jobfile_string += self.status_header(batch.full_name+'_${PBS_JOBID%%.*}.status')
         for i,run in enumerate(batch.run_commands): 
-            jobfile_string += '{} 1> {} 2>&1\n'.format(run, batch.logfile_names[i])
+            jobfile_string += '{} 1> {} 2>&1 || pounce_exit=$?\n'.format(run, batch.logfile_names[i])
+        jobfile_string += self.status_footer()
         batch.jobfile_name = batch.full_name + "_jobfile"
         with open(batch.jobfile_name,'w+') as jf:
             jf.write(jobfile_string)
@@ -129,10 +148,7 @@ class Hawk(Machine):
         args=['qsub','-W','group_list=iag12850',batch.jobfile_name]
         # args=['qsub',batch.jobfile_name]
         # args=['qsub','-q','test',batch.jobfile_name]
-        if self.remote: 
-           args=self.to_ssh(args)
-        job = subprocess.run(args,shell=self.remote,stdout=subprocess.PIPE,
-                             stderr=subprocess.PIPE,universal_newlines=True)
+        job = self.run_command(args)
         lines = job.stdout.split("\n")
         # if self.remote: 
         lines = lines[:-1]
@@ -141,27 +157,83 @@ class Hawk(Machine):
         batch.queue_status="submitted"
         globels.update_step()
     
-    def to_ssh(self,args): 
+    def run_command(self,args): 
+        """
+        run a command (list of arguments) on the cluster and return the 
+        CompletedProcess. In remote mode, the command is sent to the 
+        persistent remote shell and run in the working directory there.
+        """
+        if self.remote: 
+            return run_remote(self.remote_shell,args,self.dir_on_hawk)
+        return subprocess.run(args,stdout=subprocess.PIPE,
+                              stderr=subprocess.PIPE,universal_newlines=True)
+
+    @staticmethod
+    def status_header(status_file): 
+        """
+        Shell code for the beginning of a jobfile. The status file is 
+        written at the end of the job or if the job is killed (e.g. due 
+        to the walltime limit). It contains the exit code, start and end 
+        time and an error marker ("none", "exit_code" or "killed"). 
+        It is written to a temporary file first and then moved, such 
+        that it is complete once it is found.
+        """
+        return ('pounce_status_file={}\n'.format(status_file)
+              + 'pounce_write_status() {\n'
+              + '    printf "exit_code: %s\\nstart: %s\\nend: %s\\nerror: %s\\n" '
+              +         '"$pounce_exit" "$pounce_start" "$(date +%s)" "$1" > $pounce_status_file.tmp\n'
+              + '    mv $pounce_status_file.tmp $pounce_status_file\n'
+              + '}\n'
+              + "trap 'pounce_exit=143; pounce_write_status killed; exit 143' TERM\n"
+              + 'pounce_start=$(date +%s)\n'
+              + 'pounce_exit=0\n\n')
+
+    @staticmethod
+    def status_footer(): 
+        return ('\nif [ $pounce_exit -eq 0 ]; then pounce_write_status none; '
+                + 'else pounce_write_status exit_code; fi\n')
+
+    @staticmethod
+    def read_status(status_file): 
         """
-        converts a command into the same command passed via ssh
-        (each argument is an item of a list; in the ssh command, 
-        the original command appears as one argument and thus one 
-        string)
+        read status file written by the jobfile. Returns None if it 
+        does not exist (yet).
         """
-        command = "cd "+self.dir_on_hawk+" && "+" ".join(args)
-        return "echo '"+command+"' | ssh "+self.ssh_command
+        try: 
+            with open(status_file) as f:
+                lines = f.read().splitlines()
+        except FileNotFoundError: 
+            return None
+        return dict(line.split(": ",1) for line in lines if ": " in line)
+
+    def status_files(self,batch): 
+        return [batch.full_name+"_"+str(batch.job_id)+".status"]
 
     def wait_finished(self,table):
         """
         Monitors all jobs on HPE Hawk HPC queue. 
-        Checks if jobfile finished.
+        Completion of a job is detected via the status file written at 
+        the end of its jobfile. The status files are polled with an 
+        interval, which increases as long as nothing changes. 
+        The queue status is read only occasionally to display it and 
+        to detect jobs which ended without writing a status file.
         """
+        interval = self.poll_interval_min
+        t_qstat = None
         while True:
             # loop until all jobs are finished
-            statuses=self.read_qstat()
+            if t_qstat is None or time.time()-t_qstat >= self.qstat_interval: 
+                statuses=self.read_qstat()
+                t_qstat = time.time()
+            else: 
+                statuses = None
             has_changes=False
             for batch in self.unfinished_batches:
-                if batch.job_id in statuses:
+                if all(os.path.isfile(f) for f in self.status_files(batch)): 
+                    queue_status = "C"
+                elif statuses is None: 
+                    queue_status = batch.queue_status
+                elif batch.job_id in statuses:
                     queue_status = statuses[batch.job_id]
                 else:
                     # after restart, completed job can be removed from qstat
@@ -176,20 +248,19 @@ class Hawk(Machine):
                     self.check_errorfile(batch)
             if has_changes:
                 print_table(table,add_cr=False)
+                interval = self.poll_interval_min
+            else: 
+                interval = min(1.5*interval,self.poll_interval_max)
             if not self.unfinished_batches:
                 return
-            time.sleep(1)
+            time.sleep(interval)
 
 
     def read_qstat(self):
         """
         run 'qstat' on hawk and read output
         """
-        args=['qstat']
-        if self.remote: 
-           args=self.to_ssh(args)
-        job = subprocess.run(args,shell=self.remote,stdout=subprocess.PIPE,
-                             stderr=subprocess.PIPE,universal_newlines=True)
+        job = self.run_command(['qstat'])
         lines = job.stdout.split('\n')
         for i_line,line in enumerate(lines): 
             if line.startswith("Job id"):
@@ -214,11 +285,27 @@ class Hawk(Machine):
         """
         open error file and parse errrors. 
         Well, parse is a strong word here.
+        If the status file reports a successful job, the error file is 
+        not needed. Otherwise, the error file is read once it exists. 
+        This routine does not wait for it but is called again in the 
+        next polling step.
         """
+        batch.job_status = self.read_status(self.status_files(batch)[0])
+        if batch.job_status and batch.job_status["error"] == "none": 
+            batch.finished=True
+            return
         batch.errfile_name = batch.full_name + ".e" + str(batch.job_id)
         # sometimes hawk needs a while to finish up jobs
         if not os.path.isfile(batch.errfile_name):
-            time.sleep(5)
+            if not getattr(batch,"t_errfile_wait",None): 
+                batch.t_errfile_wait = time.time()
+            if time.time() - batch.t_errfile_wait < self.errfile_timeout: 
+                return
+            p_print(red("Warning: ")+"error file "+yellow(batch.errfile_name)+" not found.")
+            batch.t_errfile_wait = None
+            batch.finished=True
+            return
+        batch.t_errfile_wait = None
         with open(batch.errfile_name) as f:
             lines = f.read().splitlines()
         # empty error file: all good
@@ -230,6 +317,9 @@ class Hawk(Machine):
                 batch.batch_walltime *= 2
                 self.submit_job(batch,resub=True)
                 return
+        if batch.job_status: 
+            p_print(red("Warning: ")+"job {} of batch {} ended with exit code {} (error: {}).".format(
+                    batch.job_id,batch.name,batch.job_status["exit_code"],batch.job_status["error"]))
         # other error (disabled, since output is piped and module list output goes to stderr)
         # raise Exception('Error in jobfile execution! '
                         # + 'See file {} for details.'.format(batch.errfile_name))
@@ -1,9 +1,11 @@
 import shlex
 import subprocess
 import math
+import numpy as np
 import prettytable as pt
 
 from .machine import Machine
+from .scheduler import Scheduler, Job
 from helpers.printtools import *
 from helpers.tools import *
 
@@ -29,20 +31,115 @@ class Local(Machine):
     def run_batches(self):
         """
         Runs a job by calling a subprocess.
+        The run commands of all active batches are collected in one 
+        scheduler, which runs them concurrently (as far as the number of 
+        cores permits) with parallelization "pool", "gnu" or "mpi". 
+        Otherwise, they are run one after another.
         """
         # TODO: do not change run_commands but create new variable instead
         # & pipe in different logfiles
         # OR: adapt check_finished to find errors even for several runs
+        if self.multi_sample and self.parallelization != "none": 
+            scheduler = Scheduler(self.n_max_cores)
+        else: 
+            scheduler = Scheduler(1)
         for batch in self.active_batches:
             self.prepare_run_commands(batch)
-            
-            for i,cmd in enumerate(batch.run_commands):
-                p_print("run command "+yellow(cmd))
-                p_print("    logfile "+yellow(batch.logfile_names[i]))
-                with open(batch.logfile_names[i],'w+') as f:
-                    subprocess.run(cmd,stdout=f,shell=True)
+            batch.jobs = self.make_jobs(batch)
+            for job in batch.jobs: 
+                scheduler.add(job)
+        scheduler.run()
+        for batch in self.active_batches:
+            # exit codes can be checked in the batch's check_finished routine
+            batch.exit_codes = [job.exit_code for job in batch.jobs]
+            del batch.jobs
         self.check_all_finished()
 
+    def can_pipeline(self,stage): 
+        """
+        Stages can be pipelined if both are run on local machines with 
+        a process pool. 
+        """
+        if not (isinstance(stage,Local) and self.parallelization == "pool" 
+                and stage.parallelization == "pool"): 
+            p_print(red("Warning: ")+"Stage "+stage.name+" cannot be pipelined "
+                    "(requires local machines with parallelization pool).")
+            return False
+        return True
+
+    def run_pipeline(self,stages): 
+        """
+        Runs the batches of several stages in one scheduler. 
+        A run command depends on the run commands of the previous stage
+        of the same model or level. If both stages have one run command
+        per sample, only the command of the same sample is waited for. 
+        Otherwise (e.g. for a stage which collects all samples), all 
+        commands of the previous stage have to be finished. 
+        """
+        scheduler = Scheduler(max(s.n_max_cores for s in stages))
+        last_jobs = {}
+        for stage in stages: 
+            for i_batch, batch in enumerate(stage.batches): 
+                if batch not in stage.active_batches: 
+                    continue
+                stage.prepare_run_commands(batch)
+                batch.jobs = stage.make_jobs(batch,last_jobs.get(i_batch,[]))
+                for job in batch.jobs: 
+                    scheduler.add(job)
+                if batch.jobs: 
+                    last_jobs[i_batch] = batch.jobs
+        scheduler.run()
+        for stage in stages: 
+            for batch in stage.active_batches:
+                batch.exit_codes = [job.exit_code for job in batch.jobs]
+                del batch.jobs
+            stage.check_all_finished()
+
+    def make_jobs(self,batch,prev=[]): 
+        """
+        Set up a scheduler job for each run command of the batch. 
+        Jobs depend on the given jobs of a previous stage (either 
+        sample by sample or on all of them, see run_pipeline).
+        The walltime of each job is estimated from the predicted work
+        of its samples, such that the longest jobs can be started first.
+        With gnu, a job runs a fixed chunk of samples in sample order 
+        (the solvers read the outputs in this order) and takes as long
+        as its longest sample. With mpi, one job runs all samples.
+        """
+        per_sample = len(prev) == batch.n_runs == batch.samples.n
+        n_cores = self.cores_per_run(batch)
+        jobs = []
+        for i, (cmd,lfn) in enumerate(zip(batch.run_commands,batch.logfile_names)): 
+            deps = [prev[i]] if per_sample else prev
+            jobs.append(Job(cmd,lfn,n_cores,deps))
+
+        if jobs and self.multi_sample: 
+            i_run = getattr(batch,"i_samples_run",range(batch.samples.n))
+            w = batch.predict_sample_work(batch.samples.nodes[i_run])
+            if len(jobs) == len(w): 
+                for job, w_sample in zip(jobs,w): 
+                    job.est_walltime = w_sample/n_cores
+            elif self.parallelization == "gnu": 
+                n_chunk = batch.n_parallel_runs
+                for i, job in enumerate(jobs): 
+                    job.est_walltime = np.max(w[i*n_chunk:(i+1)*n_chunk],initial=0.)/batch.cores_per_sample
+            else: 
+                for job in jobs: 
+                    job.est_walltime = np.sum(w)/(len(jobs)*n_cores)
+        return jobs
+
+    def cores_per_run(self,batch): 
+        """
+        number of cores occupied by one run command of the batch
+        """
+        if not self.multi_sample or self.parallelization == "none": 
+            return 1
+        elif self.parallelization == "pool": 
+            return batch.cores_per_sample
+        else: 
+            # gnu and mpi: one command runs several samples in parallel
+            return batch.n_cores
+
     def allocate_resources(self):
         if not self.multi_sample:
             p_print("Nothing to be done.")
@@ -52,7 +149,7 @@ class Local(Machine):
             for batch in self.active_batches:
                 batch.n_parallel_runs=1
                 batch.n_sequential_runs=batch.samples.n
-        elif self.parallelization in ["gnu","mpi"]: 
+        elif self.parallelization in ["gnu","mpi","pool"]: 
             table = pt.PrettyTable()
             table.field_names = ["batch", "# parallel runs", "# sequential runs", "# total cores"]
             for batch in self.active_batches:
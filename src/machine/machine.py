@@ -13,7 +13,7 @@ class Machine(Stage,BaseClass):
     """
 
     defaults_ = {
-        "parallelization" : "none", # options: "none", "mpi", "gnu"
+        "parallelization" : "none", # options: "none", "mpi", "gnu", "pool" (local only)
         "name" : "default"
         }
 
@@ -29,10 +29,9 @@ class Machine(Stage,BaseClass):
     def to_gnu(self,batch): 
         cmd_lists = [cmd.split(" ") for cmd in batch.run_commands]
         cmds_new = []
-        for i in range(batch.n_sequential_runs): 
-            i_min = i*batch.n_parallel_runs
-            i_max = min((i+1)*batch.n_parallel_runs,batch.samples.n)
-            runs_loc = cmd_lists[i_min:i_max]
+        # there can be fewer commands than samples (e.g. cached samples)
+        for i_min in range(0,len(cmd_lists),batch.n_parallel_runs): 
+            runs_loc = cmd_lists[i_min:i_min+batch.n_parallel_runs]
             cmds_new.append(self.to_gnu_cmd(runs_loc))
         batch.run_commands = cmds_new
 
@@ -47,5 +46,4 @@ class Machine(Stage,BaseClass):
             
 
 
-
-from . import *
+# subclasses are imported on demand (see BaseClass.subclass)
@@ -0,0 +1,155 @@
+import os
+import atexit
+import shlex
+import subprocess
+import threading
+import uuid
+from concurrent.futures import Future
+
+from helpers.printtools import *
+
+
+class RemoteShell():
+    """
+    Long-lived shell on a remote machine (e.g. started with
+    'ssh -T host bash'), which is used for all commands during the
+    simulation instead of opening a new ssh connection for every
+    command.
+    Commands are written to the stdin of the shell without waiting for
+    previous ones (pipelining). The remote shell runs them in order; its
+    output is read by a separate thread, which splits it at marker
+    lines and resolves the future of the according command.
+    """
+
+    def __init__(self,shell_command):
+        self.shell_command = shell_command
+        self.marker = "__POUNCE_"+uuid.uuid4().hex+"__"
+        self.pending = []
+        self.terminated = False
+        self.lock = threading.Lock()
+        p_print("Open remote shell "+yellow(shell_command))
+        self.process = subprocess.Popen(shell_command,shell=True,stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE,
+                                        universal_newlines=True,bufsize=1)
+        self.reader = threading.Thread(target=self.read,daemon=True)
+        self.reader.start()
+
+    @property
+    def alive(self):
+        return not self.terminated and self.process.poll() is None
+
+    def submit(self,command):
+        """
+        Send command to the remote shell. Returns a future, whose result
+        is a CompletedProcess with the exit code, stdout and stderr.
+        Stderr is written to a temporary file on the remote side and
+        sent after stdout.
+        """
+        future = Future()
+        future.command = command
+        wrapped = ('pounce_err=$(mktemp); ( {} ) </dev/null 2>$pounce_err; pounce_rc=$?; '
+                   'printf "\\n{m}\\n"; cat $pounce_err; rm -f $pounce_err; '
+                   'printf "\\n{m} %s\\n" $pounce_rc\n').format(command,m=self.marker)
+        with self.lock:
+            if not self.alive:
+                raise Exception("Remote shell '"+self.shell_command+"' is not running.")
+            self.pending.append(future)
+            try:
+                self.process.stdin.write(wrapped)
+                self.process.stdin.flush()
+            except OSError:
+                # the reader thread fails the pending commands
+                pass
+        return future
+
+    def run(self,command):
+        """
+        run command and wait for the result
+        """
+        return self.submit(command).result()
+
+    def read(self):
+        """
+        Reader thread: collect the output of the pending commands.
+        """
+        stdout, stderr = [], None
+        for line in self.process.stdout:
+            if line.startswith(self.marker):
+                if stderr is None:
+                    # end of stdout
+                    stderr = []
+                    continue
+                returncode = int(line.split()[1])
+                with self.lock:
+                    future = self.pending.pop(0)
+                # remove the newline added before each marker
+                out, err = "".join(stdout)[:-1], "".join(stderr)[:-1]
+                future.set_result(subprocess.CompletedProcess(
+                        future.command,returncode,out,err))
+                stdout, stderr = [], None
+            elif stderr is None:
+                stdout.append(line)
+            else:
+                stderr.append(line)
+        # shell terminated: fail all remaining commands
+        with self.lock:
+            self.terminated = True
+            for future in self.pending:
+                future.set_exception(Exception("Remote shell '"+self.shell_command
+                                               +"' terminated."))
+            self.pending = []
+
+    def close(self):
+        if self.alive:
+            self.process.stdin.close()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.terminate()
+                self.process.wait()
+
+
+# The shells are kept at module level, since they cannot be pickled
+# along with the simulation.
+
+shells = {}
+
+def get_shell(shell_command):
+    """
+    get the remote shell for the given command and (re)start it
+    if necessary.
+    """
+    if shell_command not in shells or not shells[shell_command].alive:
+        shells[shell_command] = RemoteShell(shell_command)
+    return shells[shell_command]
+
+@atexit.register
+def close_shells():
+    for shell in shells.values():
+        shell.close()
+    shells.clear()
+
+def forget_shells():
+    """
+    Forked processes (e.g. worker pools) must not keep the stdin of the
+    shells open, since the shells are only closed at EOF.
+    """
+    for shell in shells.values():
+        try:
+            shell.process.stdin.close()
+        except OSError:
+            pass
+    shells.clear()
+
+os.register_at_fork(after_in_child=forget_shells)
+
+
+def run_remote(shell_command,args,directory=None):
+    """
+    run command (list of arguments) in the remote shell, optionally in
+    the given directory on the remote machine.
+    """
+    command = shlex.join(args)
+    if directory:
+        command = "cd "+shlex.quote(directory)+" && "+command
+    return get_shell(shell_command).run(command)
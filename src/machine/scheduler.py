@@ -0,0 +1,95 @@
+import subprocess
+import threading
+import queue
+
+from helpers.printtools import *
+
+
+class Job():
+    """
+    A single shell command which is run by the Scheduler.
+    Stdout and stderr are piped to the logfile, the exit code is
+    stored as attribute after the command finished.
+    A job is only started after all jobs it depends on are finished.
+    """
+
+    def __init__(self,cmd,logfile,n_cores=1,depends_on=None,est_walltime=0.):
+        self.cmd = cmd
+        self.logfile = logfile
+        self.n_cores = n_cores
+        self.depends_on = depends_on if depends_on else []
+        self.est_walltime = est_walltime
+        self.exit_code = None
+        self.finished = False
+
+    @property
+    def ready(self):
+        return all(job.finished for job in self.depends_on)
+
+
+class Scheduler():
+    """
+    Managed process pool for local runs.
+    Keeps as many jobs running as fit into the given number of cores,
+    the next job is started as soon as a running one finishes
+    (i.e. jobs are taken from a dynamic queue instead of being grouped
+    into fixed chunks as with GNU parallel).
+    Jobs with the longest estimated walltime are started first to 
+    avoid that a single long job is started last.
+    Each job is run as a subprocess, which is supervised by a thread.
+    """
+
+    def __init__(self,n_max_cores):
+        self.n_max_cores = max(1,n_max_cores)
+        self.jobs = []
+
+    def add(self,job):
+        self.jobs.append(job)
+
+    def run(self):
+        """
+        Run all jobs and return once all of them are finished.
+        """
+        # stable sort: without walltime estimates, the order is kept.
+        waiting = sorted(self.jobs,key=lambda job: -job.est_walltime)
+        finished = queue.Queue()
+        n_running = 0
+        n_cores_free = self.n_max_cores
+        while waiting or n_running > 0:
+            # start as many waiting jobs as the free cores allow.
+            # A job which requires more cores than available in total
+            # is run on its own.
+            for job in list(waiting):
+                n_cores = min(job.n_cores,self.n_max_cores)
+                if job.ready and n_cores <= n_cores_free:
+                    waiting.remove(job)
+                    n_cores_free -= n_cores
+                    n_running += 1
+                    self.start(job,finished)
+            if n_running == 0: 
+                raise Exception("Scheduler: jobs with unresolvable dependencies")
+            job = finished.get()
+            job.finished = True
+            n_cores_free += min(job.n_cores,self.n_max_cores)
+            n_running -= 1
+            if job.exit_code != 0:
+                p_print(red("Warning: ")+"command "+yellow(job.cmd)
+                        +" returned exit code "+str(job.exit_code)
+                        +". See "+yellow(job.logfile)+".")
+
+    def start(self,job,finished):
+        p_print("run command "+yellow(job.cmd))
+        p_print("    logfile "+yellow(job.logfile))
+        thread = threading.Thread(target=self.execute,args=(job,finished),daemon=True)
+        thread.start()
+
+    @staticmethod
+    def execute(job,finished):
+        try:
+            with open(job.logfile,'w+') as f:
+                job.exit_code = subprocess.run(job.cmd,stdout=f,stderr=subprocess.STDOUT,
+                                               shell=True).returncode
+        except OSError:
+            job.exit_code = -1
+        finally:
+            finished.put(job)
@@ -0,0 +1,198 @@
+import math
+import getpass
+from collections import Counter
+
+from .hawk import Hawk
+from helpers.printtools import *
+from helpers.tools import *
+from helpers import globels
+
+class Slurm(Hawk):
+    """
+    Generic cluster with the Slurm workload manager.
+    The resources are determined as for Hawk. Each batch is submitted
+    as one job array, where every run command (i.e. every sample with
+    parallelization "none" or every sequential round of samples with
+    "gnu") is an array element. These can then be scheduled (and
+    backfilled) by Slurm independently of each other.
+    """
+
+    cname = "slurm"
+
+    defaults_={
+        "cores_per_node" : 128,
+        "partition" : None,
+        "account" : None,
+        "max_array_tasks" : None, # max. number of simultaneously running array elements
+        "sbatch_options" : [], # further lines '#SBATCH <option>' in the jobfile
+        "job_setup" : [], # shell commands run before the run command, e.g. 'module load ...'
+        "max_resubmissions" : 3
+        }
+
+    # states of array elements (sacct), for which the element is re-submitted
+    resubmit_states = ["TIMEOUT","NODE_FAIL","PREEMPTED","BOOT_FAIL"]
+    # states of array elements (sacct), which are not final yet
+    active_states = ["PENDING","RUNNING","REQUEUED","RESIZING","SUSPENDED","COMPLETING"]
+
+
+    def submit_job(self,batch,resub=False,elements=None):
+        """
+        Generates the jobfile and submits the job array for a batch.
+        If elements (indices of run commands) are given, only these
+        elements of the array are submitted.
+        """
+        if not resub:
+            self.prepare_run_commands(batch)
+            batch.n_resubmissions = 0
+        if elements is None:
+            elements = list(range(batch.n_runs))
+        batch.elements = elements
+
+        n_cores = self.cores_per_element(batch)
+        jobfile_string = (
+              '#!/bin/bash\n'
+            + '#SBATCH --job-name={}\n'.format(batch.full_name)
+            + '#SBATCH --nodes={}\n'.format(math.ceil(n_cores/self.cores_per_node))
+            + '#SBATCH --ntasks={}\n'.format(n_cores)
+            + '#SBATCH --time={}\n'.format(time_to_str(self.element_walltime(batch)))
+            + '#SBATCH --output={}_%A_%a.out\n'.format(batch.full_name))
+        if self.partition:
+            jobfile_string += '#SBATCH --partition={}\n'.format(self.partition)
+        if self.account:
+            jobfile_string += '#SBATCH --account={}\n'.format(self.account)
+        for option in self.sbatch_options:
+            jobfile_string += '#SBATCH {}\n'.format(option)
+        jobfile_string += "\n" + "".join(line+"\n" for line in self.job_setup)
+        jobfile_string += 'cd $SLURM_SUBMIT_DIR\n\n'
+
+        jobfile_string += self.status_header(
+                batch.full_name+'_${SLURM_ARRAY_JOB_ID}_${SLURM_ARRAY_TASK_ID}.status')
+        jobfile_string += 'case $SLURM_ARRAY_TASK_ID in\n'
+        for i,run in enumerate(batch.run_commands):
+            jobfile_string += '    {}) {} 1> {} 2>&1 || pounce_exit=$? ;;\n'.format(
+                    i, run, batch.logfile_names[i])
+        jobfile_string += 'esac\n'
+        jobfile_string += self.status_footer()
+
+        batch.jobfile_name = batch.full_name + "_jobfile"
+        with open(batch.jobfile_name,'w+') as jf:
+            jf.write(jobfile_string)
+
+        # submit job
+        array = ",".join(str(i) for i in elements)
+        if self.max_array_tasks:
+            array += "%"+str(self.max_array_tasks)
+        args=['sbatch','--parsable','--array='+array,batch.jobfile_name]
+        job = self.run_command(args)
+        if job.returncode != 0:
+            raise Exception("Submission of batch "+batch.name+" failed: "+job.stderr)
+        # output of --parsable: "<job id>" or "<job id>;<cluster>"
+        batch.job_id=int(job.stdout.split()[-1].split(";")[0])
+        p_print("submitted job array "+str(batch.job_id)+" ("+str(len(elements))
+                +" elements) for batch "+batch.name)
+        batch.queue_status="submitted"
+        globels.update_step()
+
+    def cores_per_element(self,batch):
+        """
+        number of cores required for one run command
+        """
+        if self.multi_sample and self.parallelization == "none":
+            return batch.cores_per_sample
+        return batch.n_cores
+
+    def element_walltime(self,batch):
+        """
+        walltime of one run command. With parallelization "mpi", the
+        batch consists of a single run command.
+        """
+        if self.multi_sample and self.parallelization != "mpi":
+            walltime = batch.batch_walltime/batch.n_sequential_runs
+        else:
+            walltime = batch.batch_walltime
+        # Slurm's time limit is given in minutes
+        return 60*max(1,math.ceil(walltime/60))
+
+
+    def status_files(self,batch):
+        return [batch.full_name+"_"+str(batch.job_id)+"_"+str(i)+".status"
+                for i in batch.elements]
+
+
+    def read_qstat(self):
+        """
+        Get the states of the array elements of all jobs of the user
+        with a single call of 'squeue'. Returns a summary of the element
+        states for each job array, e.g. "R:2 PD:6".
+        """
+        args=['squeue','-h','-r','-u',getpass.getuser(),'-o','%i,%t']
+        job = self.run_command(args)
+        states = {}
+        for line in job.stdout.splitlines():
+            try:
+                job_id, state = line.strip().split(",")
+                job_id = int(job_id.split("_")[0])
+            except ValueError:
+                continue
+            states.setdefault(job_id,Counter())[state] += 1
+        return {job_id:" ".join(k+":"+str(v) for k,v in sorted(c.items()))
+                for job_id,c in states.items()}
+
+
+    def check_errorfile(self,batch):
+        """
+        Get the final states of all array elements with a single call
+        of 'sacct'. Elements which ran into the time limit are
+        re-submitted with double walltime, elements with node failures
+        are re-submitted as well. Failed elements are reported, the
+        solver then detects errors in its check_finished routine.
+        If the status files of all elements report success, sacct is
+        not called.
+        """
+        status = [self.read_status(f) for f in self.status_files(batch)]
+        if all(st and st["error"] == "none" for st in status):
+            batch.finished=True
+            return
+
+        args=['sacct','-n','-P','-X','-j',str(batch.job_id),'-o','JobID,State']
+        job = self.run_command(args)
+        if job.returncode != 0:
+            p_print(red("Warning: ")+"sacct failed, states of job "+str(batch.job_id)
+                    +" cannot be checked: "+job.stderr.strip())
+            batch.finished=True
+            return
+
+        states = {}
+        for line in job.stdout.splitlines():
+            if "|" not in line:
+                continue
+            element, state = line.split("|")[:2]
+            state = state.split()[0] if state.split() else "PENDING"
+            element = element.split("_")[-1]
+            if not element.isdigit() or state in self.active_states:
+                # accounting not up to date yet (or pending elements
+                # summarized as e.g. "123_[4-7]")
+                return
+            states[int(element)] = state
+        if not states:
+            return
+
+        resub = sorted(i for i,s in states.items() if s in self.resubmit_states)
+        if resub and batch.n_resubmissions < self.max_resubmissions:
+            if any(states[i] == "TIMEOUT" for i in resub):
+                p_print("Batch {} job exceeded walltime ({}). ".format(
+                            batch.name,time_to_str(self.element_walltime(batch)))
+                        +"Re-submit with double walltime.")
+                batch.batch_walltime *= 2
+            p_print("Re-submit {} element(s) of batch {}.".format(len(resub),batch.name))
+            batch.n_resubmissions += 1
+            self.submit_job(batch,resub=True,elements=resub)
+            return
+
+        failed = sorted(i for i,s in states.items() if s != "COMPLETED")
+        for i in failed:
+            p_print(red("Warning: ")+"element {} of job {} ended with state {}. See {}.".format(
+                    i,batch.job_id,states[i],yellow(batch.logfile_names[i])))
+
+        # all runs are finished
+        batch.finished=True
@@ -24,6 +24,7 @@ Allowed usage:
 python3 pounce.py parameter.yml
 python3 pounce.py -r
 python3 pounce.py -r parameter.yml
+python3 pounce.py --check parameter.yml
 """
 n_args=len(sys.argv)
 
@@ -34,6 +35,12 @@ print_header()
 
 is_prm_file = sys.argv[-1].endswith(('yml','yaml'))
 restart_mode = sys.argv[1] in ['-r','--restart']
+check_mode = sys.argv[1] in ['-c','--check']
+
+if check_mode and n_args == 3 and is_prm_file:
+    # only validate the parameter file
+    config.check(sys.argv[-1])
+    sys.exit()
 
 # configure simulation, set up class structure
 if n_args == 2 and is_prm_file:
@@ -45,7 +52,7 @@ elif restart_mode and n_args == 2:
     print_major_section("Restart simulation")
     simulation = config.restart()
 elif restart_mode and n_args == 3 and is_prm_file:
-    # restart with changed parameters (not yet implemented)
+    # restart with changed parameters
     print_major_section("Restart simulation")
     simulation = config.restart(prmfile=sys.argv[-1])
 else:
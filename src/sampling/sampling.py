@@ -1,15 +1,77 @@
-import chaospy as cp
 import numpy as np
+import warnings
 
 from helpers.baseclass import BaseClass
 from helpers.printtools import *
+from helpers.tools import *
+from helpers.cache import QuadratureCache
 
 
 class Sampling(BaseClass):
     """
     parent class with placeholders for the sampling strategies
+    The stochastic variables can be correlated by a Gaussian copula: 
+    correlation is the correlation matrix of the underlying standard 
+    normal variables (one row and column per variable).
     """
 
+    defaults_={
+        "correlation": None  # correlation matrix of the stochastic variables (Gaussian copula)
+        }
+
+    def __init__(self,*args): 
+        super().__init__(*args)
+        self.cholesky = None
+        if self.correlation is not None: 
+            corr = np.array(self.correlation,dtype=float)
+            if corr.ndim != 2 or corr.shape[0] != corr.shape[1] \
+                    or not np.allclose(corr,corr.T) or not np.allclose(np.diag(corr),1.): 
+                raise InputPrmError("correlation has to be a symmetric matrix with unit diagonal.")
+            try: 
+                self.cholesky = np.linalg.cholesky(corr)
+            except np.linalg.LinAlgError: 
+                raise InputPrmError("correlation has to be positive definite.")
+
+    def uniform_to_nodes(self,u): 
+        """
+        map uniform numbers (one column per variable) by the inverse 
+        CDF of the variables (via the copula, if they are correlated)
+        """
+        if getattr(self,"cholesky",None) is not None: 
+            from scipy.special import ndtri
+            return self.normal_to_nodes(ndtri(u))
+        nodes = np.empty(np.shape(u))
+        for i_var, var in enumerate(self.stoch_vars):
+            nodes[:,i_var] = var.ppf(u[:,i_var])
+        return nodes
+
+    def normal_to_nodes(self,z): 
+        """
+        map independent standard normal numbers (one column per 
+        variable) to the variables. With correlation, the whole block
+        is correlated with the Cholesky factor first.
+        """
+        from scipy.special import ndtr
+        cholesky = getattr(self,"cholesky",None)
+        if cholesky is not None: 
+            if len(cholesky) != len(self.stoch_vars): 
+                raise InputPrmError("correlation has to be of size {0} x {0}.".format(len(self.stoch_vars)))
+            z = z @ cholesky.T
+        u = ndtr(z)
+        nodes = np.empty(np.shape(u))
+        for i_var, var in enumerate(self.stoch_vars):
+            nodes[:,i_var] = var.ppf(u[:,i_var])
+        return nodes
+
+    def nodes_to_uniform(self,nodes): 
+        """
+        CDF of the (uncorrelated) variables, one column per variable
+        """
+        u = np.empty(np.shape(nodes))
+        for i_var, var in enumerate(self.stoch_vars):
+            u[:,i_var] = var.cdf(nodes[:,i_var])
+        return u
+
     def get(self):
         """
         get samples
@@ -23,6 +85,20 @@ class Sampling(BaseClass):
         """
         return {}
 
+    @classmethod
+    def chosen(cls,class_dict):
+        """
+        The sampling section can choose a subclass of the sampling 
+        method of the UQ method via _type. Without _type, the sampling 
+        method itself is used.
+        """
+        string = class_dict.get("_type",cls.cname)
+        return cls if string == cls.cname else cls.subclass(string)
+
+    @classmethod
+    def create(cls,class_dict,*args):
+        return cls.chosen(class_dict)(class_dict,*args)
+
     @property
     def n_total_current(self): 
         return self.n_previous + self.n
@@ -31,14 +107,60 @@ class Sampling(BaseClass):
 class MonteCarlo(Sampling):
     """
     Vanilla Monte Carlo sampling
+    With fixed_seed, every sample gets reproducible values, which only 
+    depend on seed_id, seed_offset and its global index (i.e. including
+    n_previous), not on the iteration it is drawn in. 
+    Without fixed_seed, a block of uniform numbers is drawn from NumPy's
+    global generator and mapped to all variables at once.
+    The seed mode "legacy" re-seeds NumPy's global generator for every 
+    sample and variable. The seed mode "philox" instead uses a 
+    counter-based generator keyed by seed_id and seed_offset, whose 
+    counter is set to the global sample index. The whole block is drawn
+    in one call and mapped by the inverse CDFs of the variables, 
+    without changing the global state of NumPy.
     """
+
+    cname = "monte_carlo"
+
     defaults_={
         "fixed_seed": False,
-        "seed_offset": 0
+        "seed_offset": 0,
+        "seed_mode": "legacy",  # "legacy" or "philox"
+        "antithetic": False     # draw antithetic pairs of samples
         }
 
+    def __init__(self,*args): 
+        super().__init__(*args)
+        if self.seed_mode not in ["legacy","philox"]: 
+            raise InputPrmError("seed_mode has to be 'legacy' or 'philox'.")
+
     def get(self):
-        if self.fixed_seed: 
+        """
+        With antithetic, half of the samples are drawn and each one is
+        followed by its mirror image about the centre of the 
+        distribution. The pairs only depend on n_previous/2.
+        """
+        if not self.antithetic: 
+            self.draw()
+            return
+        if self.n % 2 or self.n_previous % 2: 
+            raise Exception("Sample numbers have to be even for antithetic pairs.")
+        n, n_previous = self.n, self.n_previous
+        self.n, self.n_previous = n//2, n_previous//2
+        try: 
+            self.draw()
+        finally: 
+            self.n, self.n_previous = n, n_previous
+        nodes = np.empty((n,len(self.stoch_vars)))
+        nodes[0::2] = self.nodes
+        for i_var, var in enumerate(self.stoch_vars):
+            nodes[1::2,i_var] = var.mirror(self.nodes[:,i_var])
+        self.nodes = nodes
+
+    def draw(self):
+        if self.fixed_seed and self.seed_mode == "philox": 
+            self.nodes = self.uniform_to_nodes(self.philox_uniform())
+        elif self.fixed_seed: 
             self.nodes=np.empty((self.n,len(self.stoch_vars)))
             for i_var, var in enumerate(self.stoch_vars):
                 for i_sample in range(self.n):
@@ -47,11 +169,38 @@ class MonteCarlo(Sampling):
                     seed = int(1e8)*self.seed_id + int(1e2)*(i_sample+self.n_previous) + i_var + self.seed_offset
                     np.random.seed(seed)
                     self.nodes[i_sample,i_var] = var.draw_samples(1)
+            if getattr(self,"cholesky",None) is not None: 
+                # independent samples are correlated via their probabilities
+                self.nodes = self.uniform_to_nodes(self.nodes_to_uniform(self.nodes))
+        else: 
+            # one block for all variables
+            self.nodes = self.uniform_to_nodes(np.random.random((self.n,len(self.stoch_vars))))
+
+    def philox_uniform(self): 
+        """
+        uniform random numbers for samples n_previous to 
+        n_previous+n-1. Each sample uses its own counter block of the 
+        Philox generator (4 numbers per counter step).
+        """
+        n_vars = len(self.stoch_vars)
+        n_steps = -(-n_vars//4) # counter steps per sample
+        key = np.random.SeedSequence([self.seed_offset,self.seed_id]).generate_state(2,np.uint64)
+        bit_generator = np.random.Philox(key=key)
+        bit_generator.advance(self.n_previous*n_steps)
+        u = np.random.Generator(bit_generator).random((self.n,4*n_steps))
+        return u[:,:n_vars]
+
+    def block_rng(self): 
+        """
+        generator for the samples of the current iteration. With 
+        fixed_seed, it only depends on seed_id, seed_offset and 
+        n_previous, else it is seeded from NumPy's global generator.
+        """
+        if self.fixed_seed: 
+            seed = np.random.SeedSequence([self.seed_offset,self.seed_id,self.n_previous])
         else: 
-            self.nodes=[]
-            for var in self.stoch_vars:
-                self.nodes.append(var.draw_samples(self.n))
-            self.nodes=np.transpose(self.nodes)
+            seed = np.random.randint(2**31)
+        return np.random.default_rng(seed)
 
     # to be precise, one could add a class 
     # IterativeMonteCarlo(MonteCarlo) here
@@ -59,26 +208,178 @@ class MonteCarlo(Sampling):
         return {"nPreviousRuns":self.n_previous}
 
 
+class LatinHypercube(MonteCarlo):
+    """
+    Latin hypercube sampling
+    The new samples of each iteration form a Latin hypercube of their 
+    own: the range of every variable is divided into n strata of equal
+    probability, each of which gets exactly one sample. The strata are
+    paired randomly between the variables. The strata are not refined
+    in later iterations, i.e. the union of the samples of several 
+    iterations is not a Latin hypercube, but a union of independent 
+    ones. seed_mode is not used.
+    """
+
+    cname = "latin_hypercube"
+
+    def draw(self):
+        rng = self.block_rng()
+        n_vars = len(self.stoch_vars)
+        strata = rng.permuted(np.tile(np.arange(self.n),(n_vars,1)),axis=1).T
+        self.nodes = self.uniform_to_nodes((strata + rng.random((self.n,n_vars)))/self.n)
+
+
+class Stratified(MonteCarlo):
+    """
+    Stratified sampling
+    The new samples of each iteration stratify the random space on their
+    own: it is divided into a grid of k^d cells of equal probability 
+    (k strata per variable with k^d <= n for d variables), each of which
+    gets one sample. The remaining n-k^d samples are drawn randomly. 
+    Hence, this is mostly useful for few variables. As for the Latin 
+    hypercube, the union of the samples of several iterations is not 
+    stratified. seed_mode is not used.
+    """
+
+    cname = "stratified"
+
+    def draw(self):
+        rng = self.block_rng()
+        n_vars = len(self.stoch_vars)
+        k = int(np.floor(self.n**(1./n_vars) + 1.E-9)) if self.n > 0 else 0
+        cells = np.indices((k,)*n_vars).reshape(n_vars,-1).T
+        u_strata = (cells + rng.random(cells.shape))/max(k,1)
+        u_random = rng.random((self.n-len(cells),n_vars))
+        self.nodes = self.uniform_to_nodes(np.concatenate((u_strata,u_random)))
+
+
+class QuasiMonteCarlo(MonteCarlo):
+    """
+    Quasi Monte Carlo sampling with scrambled Sobol or Halton sequences 
+    (scipy.stats.qmc), mapped by the inverse CDFs of the variables.
+    The samples of later iterations continue the sequence after the 
+    n_previous samples of the former ones. 
+    Each sampler (i.e. MLMC level) uses its own scrambling. With 
+    fixed_seed, it only depends on seed_id and seed_offset, else it is 
+    drawn once from NumPy's global generator.
+    Sobol points are best balanced for sample numbers (and n_previous)
+    which are powers of 2. seed_mode is not used.
+    With n_replicates > 1, the samples consist of independently 
+    scrambled replicates of the sequence with the same number of points
+    (n and n_previous count the samples of all replicates). The nodes 
+    of an iteration are ordered by replicate. The first replicate equals
+    the sequence without replicates.
+    """
+
+    cname = "quasi_monte_carlo"
+
+    defaults_={
+        "sequence": "sobol",   # "sobol" or "halton"
+        "scramble": True,
+        "n_replicates": 1      # independent randomizations (e.g. for MLQMC)
+        }
+
+    def __init__(self,*args): 
+        super().__init__(*args)
+        if self.sequence not in ["sobol","halton"]: 
+            raise InputPrmError("sequence has to be 'sobol' or 'halton'.")
+        if self.n_replicates > 1 and not self.scramble: 
+            raise InputPrmError("Replicates require scramble: True.")
+
+    def draw(self):
+        if self.n % self.n_replicates or self.n_previous % self.n_replicates: 
+            raise Exception("Sample numbers have to be multiples of n_replicates.")
+        u = [self.qmc_uniform(i_rep) for i_rep in range(self.n_replicates)]
+        self.nodes = self.uniform_to_nodes(np.concatenate(u))
+
+    def qmc_uniform(self,i_rep=0): 
+        """
+        points n_previous to n_previous+n-1 of the sequence (per 
+        replicate). Without scrambling, the first point (zero) is 
+        skipped, as its inverse CDF is not finite for unbounded variables. 
+        """
+        from scipy.stats import qmc
+        if self.fixed_seed: 
+            entropy = [self.seed_offset,self.seed_id]
+        else: 
+            # keep scrambling for the following iterations
+            if not hasattr(self,"entropy"): 
+                self.entropy = int(np.random.randint(2**31))
+            entropy = self.entropy
+        # further replicates are scrambled by the children of the seed sequence
+        spawn_key = (i_rep,) if i_rep else ()
+        rng = np.random.default_rng(np.random.SeedSequence(entropy,spawn_key=spawn_key))
+        Engine = qmc.Sobol if self.sequence == "sobol" else qmc.Halton
+        try: 
+            engine = Engine(len(self.stoch_vars),scramble=self.scramble,rng=rng)
+        except TypeError: 
+            # scipy < 1.15 
+            engine = Engine(len(self.stoch_vars),scramble=self.scramble,seed=rng)
+        n_skip = self.n_previous//self.n_replicates + (0 if self.scramble else 1)
+        if n_skip > 0: 
+            engine.fast_forward(n_skip)
+        with warnings.catch_warnings(): 
+            # balance warning of Sobol for n not a power of 2
+            warnings.simplefilter("ignore",UserWarning)
+            return engine.random(self.n//self.n_replicates)
+
+
 class GaussianQuadrature(Sampling):
     """
     Sampling at Gaussian collocation nodes based on ChaosPy routines
     Smolyak sparse grid is possible
+    With correlation, the rule is built for the independent standard 
+    normal variables of the copula and its nodes are mapped to the 
+    correlated variables.
+    The rules are cached in memory and, if quadrature_cache is given,
+    in this directory, from which they are loaded memory-mapped.
     """
+
+    cname = "gaussian_quadrature"
          
     defaults_={
         "poly_deg": "NODEFAULT",
-        "sparse_grid" : "NODEFAULT"
+        "sparse_grid" : "NODEFAULT",
+        "quadrature_cache" : None,       # directory to cache quadrature rules in
+        "quadrature_cache_max_mb" : None # least recently used rules are removed above this size
         }
 
+    rule = "G"
+    adaptive = False
+
     def get(self):
-        distributions=[var.distribution for var in self.stoch_vars]
-        nodes,self.weights = \
+        description = {
+            "distributions" : [[var.cname, var.parameters] for var in self.stoch_vars],
+            "poly_deg"      : self.poly_deg,
+            "rule"          : self.rule,
+            "sparse"        : self.sparse_grid
+            }
+        if getattr(self,"correlation",None) is not None: 
+            description["correlation"] = self.correlation
+        cache = QuadratureCache(self.quadrature_cache,self.quadrature_cache_max_mb)
+        self.nodes, self.weights = cache.get(description,self.build_rule)
+        self.n = len(self.nodes)
+
+    def build_rule(self):
+        """
+        nodes (one row per node) and weights of the quadrature rule
+        """
+        import chaospy as cp
+        correlated = getattr(self,"cholesky",None) is not None
+        if correlated: 
+            # rule for the independent standard normal variables of the copula
+            distributions=[cp.Normal(0.,1.) for var in self.stoch_vars]
+        else: 
+            distributions=[var.distribution for var in self.stoch_vars]
+        nodes,weights = \
             cp.generate_quadrature(self.poly_deg,
                                    cp.J(*distributions),
-                                   rule='G',
+                                   rule=self.rule,
                                    sparse=self.sparse_grid)
-        self.nodes=np.transpose(nodes)
-        self.n = len(self.nodes)
+        nodes = np.transpose(nodes)
+        if correlated: 
+            nodes = self.normal_to_nodes(nodes)
+        return np.ascontiguousarray(nodes), np.asarray(weights)
 
     def sampling_prms(self):
         """
@@ -92,3 +393,170 @@ class GaussianQuadrature(Sampling):
             "polyDeg"          : self.poly_deg
             })
 
+
+
+class AdaptiveSparseGrid(GaussianQuadrature):
+    """
+    Dimension-adaptive Smolyak sparse grid (Gerstner and Griebel)
+    The grid is the sum of the tensor products of differences of 1D 
+    rules for a downward closed set of multi-indices (levels per 
+    variable). It starts with the zero index and its forward neighbours.
+    In each refinement, the active index with the largest error 
+    indicator becomes old and its admissible forward neighbours are 
+    added. With nested 1D rules (clenshaw_curtis, patterson, 
+    genz_keister_24), only the new nodes have to be evaluated, the 
+    others are re-used. Non-nested rules (e.g. gaussian) work as well,
+    but without re-use.
+    nodes_all holds all nodes evaluated so far, weights refers to them.
+    poly_deg limits the sum of the levels of an index.
+    """
+
+    cname = "adaptive_sparse_grid"
+
+    defaults_={
+        "rule": "clenshaw_curtis", # 1D rule of chaospy, nested ones are recommended
+        "poly_deg": None,          # maximum sum of the levels (None: no limit)
+        "sparse_grid": True,       # not used
+        "tol": 1.E-6               # stop if the sum of the indicators of the active indices is below
+        }
+
+    adaptive = True
+
+    # highest level of 1D rules which are only tabulated up to a level
+    max_levels = {"genz_keister_16": 6, "genz_keister_18": 4, 
+                  "genz_keister_22": 4, "genz_keister_24": 4}
+
+    def __init__(self,*args): 
+        super().__init__(*args)
+        if self.cholesky is not None: 
+            raise InputPrmError("Correlated variables are not available for adaptive sparse grids.")
+
+    def get(self):
+        if not hasattr(self,"nodes_all"): 
+            n_vars = len(self.stoch_vars)
+            self.rules = {}
+            self.node_ids = {}
+            self.nodes_all = np.empty((0,n_vars))
+            zero = (0,)*n_vars
+            self.old = []
+            self.active = {}
+            self.add_indices([zero] + [self.forward(zero,i) for i in range(n_vars)])
+            del self.active[zero]
+            self.old.append(zero)
+        self.n_previous = len(self.nodes_all)
+        self.nodes = np.array(self.new_nodes).reshape(-1,self.nodes_all.shape[1])
+        for i, node in enumerate(self.new_nodes): 
+            self.node_ids[self.node_key(node)] = self.n_previous + i
+        self.nodes_all = np.concatenate((self.nodes_all,self.nodes))
+        self.n = len(self.nodes)
+        self.weights = self.combined_weights(self.old + list(self.active))
+
+    def refine(self,indicator):
+        """
+        Compute the indicators of the new active indices with the given
+        function of their weights (see delta_weights). Then refine the 
+        grid until new nodes are added. Returns False, if the sum of 
+        the indicators is below tol or no index can be refined.
+        """
+        while self.active: 
+            for index, value in self.active.items(): 
+                if value is None: 
+                    self.active[index] = indicator(self.delta_weights(index))
+            p_print("Sum of indicators of the active indices: %e"%(sum(self.active.values())))
+            if sum(self.active.values()) < self.tol: 
+                break
+            index = max(self.active,key=self.active.get)
+            del self.active[index]
+            self.old.append(index)
+            new = [self.forward(index,i) for i in range(len(index))]
+            new = [k for k in new if self.admissible(k)]
+            p_print("Refine index {}: {} new index(es)".format(index,len(new)))
+            self.add_indices(new)
+            if self.new_nodes: 
+                return True
+        return False
+
+    @staticmethod
+    def forward(index,i): 
+        return index[:i] + (index[i]+1,) + index[i+1:]
+
+    def admissible(self,index): 
+        """
+        all backward neighbours are old and the levels are allowed
+        """
+        if self.poly_deg is not None and sum(index) > self.poly_deg: 
+            return False
+        if max(index) > self.max_levels.get(self.rule,max(index)): 
+            return False
+        return all(self.forward(index,i)[:i] + (index[i]-1,) + index[i+1:] in self.old 
+                   for i in range(len(index)) if index[i] > 0)
+
+    def add_indices(self,indices): 
+        """
+        add active indices and collect the nodes of their tensor grids
+        which are not evaluated yet
+        """
+        self.new_nodes = []
+        keys = set()
+        for index in indices: 
+            self.active[index] = None
+            for node in self.tensor_rule(index)[0]: 
+                key = self.node_key(node)
+                if key not in self.node_ids and key not in keys: 
+                    keys.add(key)
+                    self.new_nodes.append(node)
+
+    @staticmethod
+    def node_key(node): 
+        return tuple(np.round(node,12))
+
+    def rule_1d(self,i_var,level): 
+        if (i_var,level) not in self.rules: 
+            import chaospy as cp
+            x, w = cp.generate_quadrature(level,self.stoch_vars[i_var].distribution,
+                                          rule=self.rule,growth=True)
+            self.rules[(i_var,level)] = (x[0], w)
+        return self.rules[(i_var,level)]
+
+    def tensor_rule(self,index): 
+        """
+        nodes (one row per node) and weights of the tensor product rule
+        """
+        rules = [self.rule_1d(i,level) for i,level in enumerate(index)]
+        nodes = np.meshgrid(*[r[0] for r in rules],indexing="ij")
+        nodes = np.stack([x.ravel() for x in nodes],axis=1)
+        weights = np.ones(1)
+        for r in rules: 
+            weights = np.multiply.outer(weights,r[1]).ravel()
+        return nodes, weights
+
+    def add_tensor_weights(self,weights,index,factor): 
+        nodes, w = self.tensor_rule(index)
+        ids = [self.node_ids[self.node_key(node)] for node in nodes]
+        np.add.at(weights,ids,factor*w)
+
+    def delta_weights(self,index): 
+        """
+        weights of the tensor product of the differences of the 1D rules
+        for an index, i.e. of its contribution to the grid
+        """
+        weights = np.zeros(len(self.nodes_all))
+        for s in np.ndindex(*(2,)*len(index)): 
+            k = tuple(np.subtract(index,s))
+            if min(k) >= 0: 
+                self.add_tensor_weights(weights,k,(-1)**sum(s))
+        return weights
+
+    def combined_weights(self,indices): 
+        """
+        weights of the sparse grid of a downward closed index set
+        (combination technique)
+        """
+        weights = np.zeros(len(self.nodes_all))
+        indices = set(indices)
+        for index in indices: 
+            c = sum((-1)**sum(s) for s in np.ndindex(*(2,)*len(index)) 
+                    if tuple(np.add(index,s)) in indices)
+            if c != 0: 
+                self.add_tensor_weights(weights,index,c)
+        return weights
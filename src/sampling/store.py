@@ -0,0 +1,153 @@
+import os
+import uuid
+import shutil
+import numpy as np
+
+
+class SampleStore():
+    """
+    Growing store of sample nodes (one row per sample).
+    The rows are kept in chunks of chunk_size rows. Appending never 
+    copies the rows of former chunks. In memory, the last chunk is only
+    allocated for the rows needed and grows geometrically up to 
+    chunk_size, such that small stores stay small. If max_memory_mb is
+    given, the chunks above this size are memory-mapped .npy files 
+    (of full size) in dirname instead of memory. dirname has to be 
+    unique for each store, by default a new subdirectory of "samples"
+    is used. remove_files deletes it.
+    Rows within one chunk are handed out as views, a range of rows
+    spanning several chunks is copied (only this range).
+    iter_chunks gives views of a range chunk by chunk.
+    When pickled (e.g. for the checkpoint), the memory-mapped chunks are
+    flushed and only referenced by file name, and are re-opened when
+    unpickled.
+    """
+
+    def __init__(self,n_vars,chunk_size=100000,max_memory_mb=None,dirname=None):
+        self.n_vars = n_vars
+        self.chunk_size = chunk_size
+        self.max_memory_mb = max_memory_mb
+        self.dirname = dirname if dirname else os.path.join("samples",uuid.uuid4().hex[:12])
+        self.chunks = []
+        self.n = 0
+
+    @classmethod
+    def from_array(cls,nodes,**kwargs):
+        store = cls(nodes.shape[1],**kwargs)
+        store.append(nodes)
+        return store
+
+    @property
+    def shape(self):
+        return (self.n,self.n_vars)
+
+    def __len__(self):
+        return self.n
+
+    def append(self,nodes):
+        """
+        copy the given rows to the end of the store
+        """
+        nodes = np.asarray(nodes).reshape(-1,self.n_vars)
+        i = 0
+        while i < len(nodes):
+            i_chunk, i_row = divmod(self.n,self.chunk_size)
+            n_copy = min(self.chunk_size-i_row,len(nodes)-i)
+            chunk = self.writable_chunk(i_chunk,i_row,i_row+n_copy)
+            chunk[i_row:i_row+n_copy] = nodes[i:i+n_copy]
+            self.n += n_copy
+            i += n_copy
+
+    def writable_chunk(self,i_chunk,n_filled,n_rows):
+        """
+        chunk i_chunk with room for at least n_rows rows, of which the
+        first n_filled ones are kept
+        """
+        if i_chunk == len(self.chunks):
+            self.chunks.append(self.new_chunk(n_rows))
+        chunk = self.chunks[i_chunk]
+        if not chunk.flags.writeable:
+            # frozen by the checkpoint (see Checkpoint): the filled 
+            # rows never change, so appending to the chunk is safe. 
+            # Chunks memory-mapped from the checkpoint are copied.
+            try:
+                chunk.flags.writeable = True
+            except ValueError:
+                chunk = np.array(chunk)
+        if len(chunk) < n_rows:
+            # grow geometrically
+            new = np.zeros((min(self.chunk_size,max(n_rows,2*len(chunk))),self.n_vars))
+            new[:n_filled] = chunk[:n_filled]
+            chunk = new
+        self.chunks[i_chunk] = chunk
+        return chunk
+
+    def new_chunk(self,n_rows):
+        size_mb = (len(self.chunks)+1)*self.chunk_size*self.n_vars*8/1.E6
+        if self.max_memory_mb is None or size_mb <= self.max_memory_mb:
+            return np.zeros((n_rows,self.n_vars))
+        os.makedirs(self.dirname,exist_ok=True)
+        filename = self.chunk_file(len(self.chunks))
+        shape = (self.chunk_size,self.n_vars)
+        return np.lib.format.open_memmap(filename,mode="w+",dtype=np.float64,shape=shape)
+
+    def remove_files(self):
+        """
+        delete the memory-mapped chunks, e.g. at the end of a run
+        without checkpoint
+        """
+        shutil.rmtree(self.dirname,ignore_errors=True)
+
+    def chunk_file(self,i_chunk):
+        return os.path.join(self.dirname,"chunk_{}.npy".format(i_chunk))
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["chunks"] = []
+        for i_chunk, chunk in enumerate(self.chunks):
+            if isinstance(chunk,np.memmap) and chunk.mode in ("r+","w+"):
+                # reference (file name, filled rows) instead of a copy
+                chunk.flush()
+                n_rows = min(self.chunk_size,self.n-i_chunk*self.chunk_size)
+                chunk = (self.chunk_file(i_chunk),n_rows)
+            state["chunks"].append(chunk)
+        return state
+
+    def __setstate__(self,state):
+        self.__dict__.update(state)
+        for i_chunk, chunk in enumerate(self.chunks):
+            if isinstance(chunk,tuple):
+                filename, n_rows = chunk
+                if not os.path.isfile(filename):
+                    raise Exception("Sample file "+filename+" with "+str(n_rows)+" rows not found.")
+                self.chunks[i_chunk] = np.lib.format.open_memmap(filename,mode="r+")
+
+    def iter_chunks(self,start=0,stop=None):
+        """
+        views of the rows start to stop-1, one per chunk
+        """
+        stop = self.n if stop is None else min(stop,self.n)
+        while start < stop:
+            i_chunk, i_row = divmod(start,self.chunk_size)
+            n_rows = min(self.chunk_size-i_row,stop-start)
+            yield self.chunks[i_chunk][i_row:i_row+n_rows]
+            start += n_rows
+
+    def __getitem__(self,key):
+        rows, rest = (key[0], key[1:]) if isinstance(key,tuple) else (key, ())
+        if isinstance(rows,slice) and rows.step in (None,1):
+            start, stop, _ = rows.indices(self.n)
+            parts = list(self.iter_chunks(start,stop))
+            if len(parts) == 1:
+                out = parts[0]
+            elif parts:
+                out = np.concatenate(parts)
+            else:
+                out = np.empty((0,self.n_vars))
+        else:
+            out = np.asarray(self)[rows]
+        return out[(slice(None),)+rest] if rest else out
+
+    def __array__(self,dtype=None,copy=None):
+        out = self[:]
+        return out if dtype is None else out.astype(dtype)
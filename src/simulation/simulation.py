@@ -16,7 +16,6 @@ class Simulation(BaseClass):
         super().__init__(class_dict)
         self.iterations=[]
         self.current_iter=None
-        self.filename = "pounce.pickle"
         self.iter_loop_finished = False
 
 
@@ -41,6 +40,10 @@ class Simulation(BaseClass):
                 self.current_iter = Iteration(name=string)
             self.process_simulation_postproc()
 
+        if not globels.do_pickle: 
+            # without checkpoint, the run cannot be restarted
+            self.remove_temporary_files()
+
         print_major_section("POUNCE Finished")
 
 
@@ -57,13 +60,41 @@ class Simulation(BaseClass):
         globels.run_step("Get samples",
                          self.get_samples, 
                          self.stages[0].active_batches)
-        for stage in self.stages:
-            stage.process()
+        for stages in self.stage_groups():
+            if len(stages) == 1: 
+                stages[0].process()
+            else: 
+                stages[0].process_pipeline(stages)
         # Prepare next iteration
         globels.run_step("Prepare next iteration",
                          self.prepare_next_iteration)
                            
 
+    def stage_groups(self):
+        """
+        Stages are normally processed one after another. 
+        A stage with the "pipeline" option is instead added to the 
+        group of the previous stage, if the machine supports this. 
+        The stages of a group are then run per sample, i.e. a sample 
+        is passed on to the next stage as soon as it is finished in 
+        the previous one.
+        """
+        groups = []
+        for stage in self.stages:
+            if (groups and getattr(stage,"pipeline",False) 
+                    and groups[-1][-1].can_pipeline(stage)):
+                groups[-1].append(stage)
+            else: 
+                groups.append([stage])
+        return groups
+
+    def remove_temporary_files(self):
+        """
+        Remove files which are only needed to restart the simulation.
+        """
+        pass
+
+
     @globels.iteration
     def process_simulation_postproc(self):
         self.internal_simulation_postproc()
@@ -86,9 +117,10 @@ class Stage():
         super().__init__(*args)
         self.batches = []
 
-    def fill(self, name, multi_sample):
+    def fill(self, name, multi_sample, pipeline=False):
         self.name = name
         self.multi_sample = multi_sample
+        self.pipeline = pipeline
 
     def prepare_set(self):
         """
@@ -113,6 +145,32 @@ class Stage():
         globels.run_step("Run "+self.name,
                          self.run_batches)
 
+    def process_pipeline(self, stages):
+        """
+        process a group of stages, which are run together as a 
+        pipeline (called for the first stage of the group). 
+        Stages are prepared before any of them is run, so this 
+        requires that preparing a stage does not depend on the 
+        output of the previous stages. 
+        """
+        stages = [s for s in stages if s.batches]
+        for stage in stages: 
+            globels.run_step("Allocate resources for "+stage.name,
+                             stage.allocate_resources)
+            globels.run_step("Prepare "+stage.name,
+                             stage.prepare_set)
+
+        globels.run_step("Run "+" + ".join(s.name for s in stages),
+                         self.run_pipeline,
+                         stages)
+
+    def can_pipeline(self, stage):
+        """
+        check if the given stage can be run in a pipeline 
+        after this stage. Has to be implemented by the machine.
+        """
+        return False
+
     @property
     def active_batches(self):
         """
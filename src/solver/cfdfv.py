@@ -140,6 +140,9 @@ class Cfdfv(Solver):
         # remove "s" in the end
         t_sum = sum(float(item[:-2]) for item in arr)
         self.current_avg_work=t_sum / self.samples.n
+        if len(arr) == self.samples.n: 
+            # one logfile per sample
+            self.record_sample_work([float(item[:-2]) for item in arr])
         return True
         # except:
             # return False
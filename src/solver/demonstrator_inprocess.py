@@ -0,0 +1,221 @@
+import os
+import sys
+import atexit
+import importlib.util
+import configparser
+import multiprocessing
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+
+from .solver import Solver,QoI
+from helpers.printtools import *
+from helpers.tools import *
+
+
+class DemonstratorInProcess(Solver):
+    """
+    Evaluates the function of the demonstrator solver
+    (externals/demonstrators/solver.py) directly instead of starting a
+    new Python interpreter for every run as in demonstrator_single.
+    The solver module is imported once in each of a pool of long-lived
+    worker processes, which receive the sample nodes via shared memory.
+    As in demonstrator_single, the model parameters (ModelName, nPoints)
+    are read from the parameter file (if given) and solver_prms.
+    As in the internal solver, no external commands are run;
+    the evaluations are done in the check_finished routine.
+    """
+
+    cname = "demonstrator_inprocess"
+
+    supports_cache = True
+
+    defaults_ = {
+        "prmfile" : None, # parameter file with defaults of the model parameters
+        "solver_prms" : {}, # parameters passed to the solver function (overwrite prmfile). Can be ModelName and/or nPoints.
+        "stoch_prm" : "StochPrm", # stochastic variable passed to the solver function
+        "function" : "solver", # name of the function in the module given by exe_path
+        "n_workers" : None # number of worker processes; default: all available cores
+        }
+
+    defaults_add = {
+        "StochVar": {
+            'name' : 'StochPrm'
+            }
+        }
+
+    class QoI(QoI):
+        """
+        Parent class for QoI's of this solver
+        """
+
+        stages = {"all"}
+
+        defaults_ = {
+            "exe_path" : "dummy_unused"
+            }
+
+        internal = True
+
+        def get_response(self,s=None):
+            return [np.array(p.u) for p in self.participants]
+
+
+    def prepare(self):
+        """
+        No external runs are prepared. The worker pool is started here
+        (if not already running from a previous iteration).
+        """
+        self.run_commands = []
+        self.model_prms()
+        get_pool(self.exe_path,self.function,self.get_n_workers())
+
+
+    def model_prms(self):
+        """
+        model name and number of points passed to the solver function
+        """
+        prms = configparser.ConfigParser()
+        if self.prmfile:
+            with open(self.prmfile,'r') as stream:
+                prms.read_string("[DEFAULT]\n" + stream.read())
+        for key,value in self.solver_prms.items():
+            prms["DEFAULT"][key] = str(value)
+        prms = prms["DEFAULT"]
+        if "ModelName" not in prms:
+            raise InputPrmError("Solver "+self.cname+": ModelName has to be given in solver_prms or prmfile.")
+        model_name = prms["ModelName"]
+        if model_name != "Integration":
+            return model_name, None
+        if "nPoints" not in prms:
+            raise InputPrmError("Solver "+self.cname+": nPoints has to be given for the Integration model.")
+        return model_name, int(prms["nPoints"])
+
+
+    def cache_config(self):
+        """
+        The results also depend on the parameter file.
+        """
+        config = super().cache_config()
+        if self.prmfile:
+            with open(self.prmfile,'r') as stream:
+                config["prmfile"] = stream.read()
+        return config
+
+
+    def get_n_workers(self):
+        if self.n_workers:
+            return self.n_workers
+        if hasattr(os,"sched_getaffinity"):
+            return len(os.sched_getaffinity(0))
+        # not available on all platforms (e.g. macOS)
+        return os.cpu_count() or 1
+
+
+    def check_finished(self):
+        """
+        Evaluate the solver function at all current sample nodes
+        in the worker pool. Samples found in the evaluation cache 
+        are not evaluated again.
+        """
+        n_workers = self.get_n_workers()
+        pool = get_pool(self.exe_path,self.function,n_workers)
+
+        self.get_cached()
+        nodes = np.ascontiguousarray(self.samples.nodes[self.i_samples_run],dtype=np.float64)
+        if len(nodes) == 0: 
+            results = []
+        else: 
+            results = self.evaluate(pool,n_workers,nodes)
+        self.store_in_cache([{"Result":r[0],"Computation Time":r[1]} for r in results])
+
+        self.u = self.merge_cached("Result",[r[0] for r in results]) # QoI value
+        self.w = self.merge_cached("Computation Time",[r[1] for r in results]) # computational work
+        # only the new evaluations count as work (cache hits are free)
+        w_new = [r[1] for r in results]
+        self.current_avg_work = np.mean(w_new if w_new else self.w)
+
+        return True
+
+
+    def evaluate(self,pool,n_workers,nodes): 
+        """
+        Distribute the given sample nodes to the worker pool via shared memory.
+        """
+        names = [s.name for s in self.samples.stoch_vars]
+        if self.stoch_prm not in names:
+            raise InputPrmError("Solver "+self.cname+": no stochastic variable "+self.stoch_prm+".")
+        i_var = names.index(self.stoch_prm)
+        model_name, n_points = self.model_prms()
+
+        shm = shared_memory.SharedMemory(create=True,size=max(nodes.nbytes,1))
+        try:
+            np.ndarray(nodes.shape,dtype=np.float64,buffer=shm.buf)[:] = nodes
+            # several chunks per worker for load balancing
+            n_chunks = min(len(nodes),4*n_workers)
+            bounds = np.linspace(0,len(nodes),n_chunks+1).astype(int)
+            tasks = [(shm.name,nodes.shape,i_min,i_max,i_var,model_name,n_points)
+                     for i_min,i_max in zip(bounds[:-1],bounds[1:])]
+            results = [r for chunk in pool.map(evaluate_chunk,tasks) for r in chunk]
+        finally:
+            shm.close()
+            shm.unlink()
+        return results
+
+
+
+class Standard(DemonstratorInProcess.QoI):
+
+    cname = "standard"
+
+
+# ---------- worker pool ----------------
+# The pools are kept at module level, since they cannot be pickled
+# along with the simulation.
+
+pools = {}
+
+def get_pool(module_path,function,n_workers):
+    """
+    get pool of worker processes, which have imported the solver
+    module, and start it if necessary.
+    """
+    key = (os.path.abspath(module_path),function,n_workers)
+    if key not in pools:
+        p_print("Start "+str(n_workers)+" worker process(es) for "+yellow(key[0]))
+        pools[key] = multiprocessing.Pool(n_workers,initializer=init_worker,initargs=key[:2])
+    return pools[key]
+
+@atexit.register
+def close_pools():
+    for pool in pools.values():
+        pool.close()
+        pool.join()
+    pools.clear()
+
+solver_function = None
+
+def init_worker(module_path,function):
+    """
+    import the solver module once in each worker process
+    """
+    global solver_function
+    sys.path.insert(0,os.path.dirname(module_path))
+    spec = importlib.util.spec_from_file_location("pounce_inprocess_solver",module_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    solver_function = getattr(module,function)
+
+def evaluate_chunk(task):
+    """
+    evaluate the solver function for a range of sample nodes,
+    which are read from shared memory.
+    """
+    shm_name, shape, i_min, i_max, i_var, model_name, n_points = task
+    shm = shared_memory.SharedMemory(name=shm_name)
+    # the shared memory is owned (and unlinked) by the main process
+    resource_tracker.unregister(shm._name,"shared_memory")
+    nodes = np.ndarray(shape,dtype=np.float64,buffer=shm.buf)
+    xi_vec = nodes[i_min:i_max,i_var].copy()
+    del nodes
+    shm.close()
+    return [solver_function(model_name,n_points,float(xi)) for xi in xi_vec]
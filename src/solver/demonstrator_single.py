@@ -1,4 +1,3 @@
-import h5py
 import numpy as np
 import subprocess
 import glob
@@ -20,6 +19,8 @@ class DemonstratorSingle(Solver):
 
     stages = {"main"}
 
+    supports_cache = True
+
     defaults_ = {
         "prmfile" : "parameter.ini",
         "solver_prms" : {}#, # parameters to be changed in every parameter filei to distinguish between levels/fidelities. Can be ModelName and/or nPoints.
@@ -85,7 +86,8 @@ class DemonstratorSingle(Solver):
 
         self.run_commands = []
         self.prmfiles = []
-        for i_sample in range(self.samples.n): 
+        self.get_cached()
+        for i_sample in self.i_samples_run: 
             try: 
                 i_sample_glob = i_sample + self.samples.n_previous + 1
             except AttributeError:
@@ -104,35 +106,66 @@ class DemonstratorSingle(Solver):
             self.run_commands.append('python3 ' + self.exe_path + ' ' + prmfile)
 
 
-    def get_qty_from_stdout(self,name): 
-        vals = []
+    def cache_config(self): 
+        """
+        The results also depend on the parameter file.
+        """
+        config = super().cache_config()
+        with open(self.prmfile,'r') as stream:
+            config["prmfile"] = stream.read()
+        return config
+
+    def read_outputs(self): 
+        """
+        Read all "name : value" lines in the output section of each run
+        from the logfiles. Returns one dict per run.
+        """
+        outputs = []
         for logfile in self.logfile_names: 
             with open(logfile,'r') as lf:
-                output = lf.read().split("===OUTPUT===")[1:]
-            for run in output:
-                found = False
-                for line in reversed(run.splitlines()): 
-                    v = re.match(r"\s*"+name+r"\s*:(.+)",line)
+                runs = lf.read().split("===OUTPUT===")[1:]
+            for run in runs:
+                out = {}
+                for line in run.splitlines(): 
+                    v = re.match(r"\s*([^:]*[^:\s])\s*:(.+)",line)
                     if v: 
-                        vals.append(v.group(1))
-                        found = True
-                        break
-                if not found: 
-                    raise Exception("Value " + name + " not found in stdout!")
-        return vals
+                        out[v.group(1)] = v.group(2).strip()
+                outputs.append(out)
+        return outputs
+
+    def get_qty_from_stdout(self,name): 
+        """
+        Get the values of an output quantity for all samples, either from 
+        the logfiles or from the evaluation cache.
+        """
+        vals = []
+        for out in self.read_outputs(): 
+            if name not in out: 
+                raise Exception("Value " + name + " not found in stdout!")
+            vals.append(out[name])
+        return self.merge_cached(name,vals)
 
     def check_finished(self):
         """ 
         Check last lines of logfiles (stdout) for confirmation that 
         the batch is finished. Also retrieve average work, which is 
-        written to the log file as well (as part of flexibatch)
+        written to the log file as well (as part of flexibatch).
+        The outputs of the new runs are stored in the evaluation cache.
         """
         arr = self.get_qty_from_stdout("Computation Time")
-        self.current_avg_work = sum(float(i) for i in arr) / self.samples.n
+        outputs = self.read_outputs()
+        self.store_in_cache(outputs)
+        # only the new runs count as work (cache hits are free)
+        w = [float(out["Computation Time"]) for out in outputs]
+        if w: 
+            self.current_avg_work = sum(w) / len(w)
+            self.record_sample_work(w,self.samples.nodes[self.i_samples_run])
+        else: 
+            # all samples cached: use their recorded work as estimate
+            self.current_avg_work = sum(float(i) for i in arr) / self.samples.n
         return True
 
 
-
 class Standard(DemonstratorSingle.QoI):
 
     cname = "standard"
@@ -1,8 +1,6 @@
-import h5py
 import numpy as np
 
 from .solver import Solver,QoI
-from .cfdfv import Cfdfv
 from helpers.printtools import *
 from helpers.tools import *
 from helpers import globels
@@ -69,6 +67,15 @@ class Internal(Solver):
         self.f = self.f_analytical if self.n_pts else self.f_analytical
 
 
+    def cache_config(self): 
+        """
+        The result depends on the number of integration points.
+        """
+        config = super().cache_config()
+        config["n_pts"] = self.n_pts
+        return config
+
+
     def prepare(self):
         """
         prpare external runs, which is trivial in this case, 
@@ -2,12 +2,14 @@ import sys,os
 import inspect
 import copy
 import types
+import numpy as np
 
 from helpers.baseclass import BaseClass
 from helpers.printtools import *
 from helpers.tools import *
 from helpers import config
 from helpers import globels
+from helpers.cache import EvaluationCache
 
 
 class Batch(BaseClass):
@@ -68,15 +70,18 @@ class Batch(BaseClass):
 
     @classmethod
     def create_by_stage(cls,prms,stage_name,*args): 
-        typename = prms["_type"]
+        inst = cls.subclass_by_stage(prms["_type"],stage_name)(prms,*args)
+        inst.stage_name = stage_name
+        return inst
+
+    @classmethod
+    def subclass_by_stage(cls,typename,stage_name): 
         TypeSub =cls.subclass(typename)
         stage_subs = []
         TypeSub.recursive_subclasses(stage_subs,TypeSub) 
         for StageSub in stage_subs: 
             if StageSub.stages & {stage_name, "all"}:
-                inst = StageSub(prms,*args)
-                inst.stage_name = stage_name
-                return inst
+                return StageSub
         raise InputPrmError(
             "no {} subclass for stage {}".format(TypeSub,stage_name))
 
@@ -94,6 +99,59 @@ class Batch(BaseClass):
         return self.sum_work[n_samples_tot] / n_samples_tot
 
 
+    # maximum number of recorded sample evaluations used for the prediction
+    max_work_history = 4096
+
+    def record_sample_work(self,w,nodes=None): 
+        """
+        Store the work of the individual sample evaluations of the 
+        current iteration along with the sample nodes (by default the 
+        first len(w) current nodes). 
+        Used to predict the work of future sample evaluations.
+        Only the latest max_work_history evaluations are kept.
+        """
+        if nodes is None: 
+            nodes = self.samples.nodes[:len(w)]
+        nodes = np.array(nodes,dtype=float).reshape(len(w),-1)
+        if not hasattr(self,"work_history"): 
+            self.work_history_nodes = np.empty((0,nodes.shape[1]))
+            self.work_history = np.empty((0,))
+        n_keep = self.max_work_history
+        self.work_history_nodes = np.concatenate((self.work_history_nodes,nodes))[-n_keep:]
+        self.work_history = np.concatenate((self.work_history,np.array(w,dtype=float)))[-n_keep:]
+
+
+    def predict_sample_work(self,nodes,n_neighbours=5): 
+        """
+        Predict the work of a sample evaluation at each of the given nodes 
+        as the inverse-distance-weighted mean of the recorded work at the 
+        nearest previous nodes (in node coordinates normalized by their 
+        standard deviation, found with a KD-tree).
+        Without recorded work for individual samples, all samples get 
+        the same (mean) work. 
+        """
+        nodes = np.array(nodes,dtype=float)
+        n_hist = len(getattr(self,"work_history",[]))
+        if n_hist == 0: 
+            n_prev = getattr(self.samples,"n_previous",0)
+            if n_prev in self.sum_work and n_prev > 0: 
+                w_mean = self.sum_work[n_prev] / n_prev
+            else: 
+                w_mean = getattr(self,"est_work",1.)
+            return np.full(len(nodes),w_mean)
+
+        # scipy is slow to import and only needed here
+        from scipy.spatial import cKDTree
+        scale = np.std(self.work_history_nodes,axis=0)
+        scale[scale == 0.] = 1.
+        tree = cKDTree(self.work_history_nodes / scale)
+        k = min(n_neighbours,n_hist)
+        d_nb, i_nb = tree.query(nodes.reshape(len(nodes),-1) / scale,k=k)
+        d_nb, i_nb = d_nb.reshape(len(nodes),k), i_nb.reshape(len(nodes),k)
+        weights = 1./np.maximum(d_nb,1.E-12)
+        return np.sum(weights*self.work_history[i_nb],axis=1)/np.sum(weights,axis=1)
+
+
 def register_batch_series(stages): 
     """
     A stage contains several batches (such as for different MFMC models), 
@@ -125,12 +183,79 @@ class Solver(Batch):
 
     defaults_ = {
         'cores_per_sample' : "NODEFAULT",
-        "solver_prms" :  "NODEFAULT"#,
+        "solver_prms" :  "NODEFAULT",
+        "cache_file" : None,        # SQLite file to cache sample evaluations in (if supported by the solver)
+        "cache_max_entries" : None  # least recently used entries are removed above this number
         # "stages" :  [{}]
         }
 
     multi_sample = True
     is_surrogate = False
+    # the solver looks up its samples in the evaluation cache (cache_file)
+    supports_cache = False
+
+    def __init__(self,*args,**kwargs): 
+        super().__init__(*args,**kwargs)
+        if self.cache_file and not self.supports_cache: 
+            raise InputPrmError("Solver "+self.cname+" does not support an evaluation cache (cache_file).")
+
+    def cache_config(self): 
+        """
+        Solver configuration which determines the result of a sample 
+        evaluation (in addition to the sample node)
+        """
+        return {"type": self.cname, 
+                "exe_path": self.exe_path, 
+                "solver_prms": self.solver_prms}
+
+    def get_cached(self): 
+        """
+        Look up the current samples in the evaluation cache. 
+        Stores the outputs of all cached samples in a dict with the
+        sample index as key. 
+        """
+        self.cached = {}
+        if not getattr(self,"cache_file",None): 
+            return self.cached
+        cache = EvaluationCache(self.cache_file,self.cache_max_entries)
+        self.cache_keys = cache.keys(self.cache_config(),self.samples.nodes[:self.samples.n])
+        found = cache.get(self.cache_keys)
+        self.cached = {i:found[k] for i,k in enumerate(self.cache_keys) if k in found}
+        if self.cached: 
+            p_print("Batch {}: {} of {} samples found in cache {}".format(
+                    self.name,len(self.cached),self.samples.n,yellow(self.cache_file)))
+        return self.cached
+
+    @property
+    def i_samples_run(self): 
+        """
+        indices of the current samples which have to be evaluated
+        """
+        cached = getattr(self,"cached",{})
+        return [i for i in range(self.samples.n) if i not in cached]
+
+    def store_in_cache(self,outputs): 
+        """
+        Store outputs of the evaluated samples (list in the order of 
+        i_samples_run) in the cache.
+        """
+        if not getattr(self,"cache_file",None): 
+            return
+        cache = EvaluationCache(self.cache_file,self.cache_max_entries)
+        cache.put({self.cache_keys[i]:o for i,o in zip(self.i_samples_run,outputs)})
+
+    def merge_cached(self,name,values): 
+        """
+        Merge the values of an output quantity of the evaluated samples 
+        (in the order of i_samples_run) with those of the cached samples.
+        """
+        cached = getattr(self,"cached",{})
+        if len(values) != self.samples.n-len(cached): 
+            raise Exception("Value " + name + " found for " + str(len(values)) + " of " 
+                            + str(self.samples.n-len(cached)) + " evaluated samples!")
+        values = iter(values)
+        return [cached[i][name] if i in cached else next(values) 
+                for i in range(self.samples.n)]
 
     @classmethod
     def create_by_stage_from_list(cls,prms,i_stage,stage_name,*args): 
@@ -182,5 +307,4 @@ class QoI(Batch):
             return qty
 
 
-from . import *
-
+# subclasses are imported on demand (see BaseClass.subclass)
@@ -1,12 +1,36 @@
 import numpy as np
-import chaospy as cp
 from helpers.baseclass import BaseClass
 
 class StochVar(BaseClass):
     """
     parent class for stochastic variables
+    The chaospy distributions are only created (and chaospy imported)
+    once they are needed, since importing chaospy is slow.
     """
-    pass
+
+    def ppf(self,u):
+        """
+        inverse cumulative distribution function
+        """
+        raise Exception("Inverse CDF not implemented for "+self.cname)
+
+    def cdf(self,x):
+        """
+        cumulative distribution function
+        """
+        raise Exception("CDF not implemented for "+self.cname)
+
+    def mirror(self,x):
+        """
+        mirror image of samples about the centre of the distribution
+        (for antithetic sampling), i.e. the samples at the opposite
+        probability for asymmetric distributions
+        """
+        return self.ppf(1.-self.cdf(x))
+
+    def draw_samples(self,n_samples):
+        return self.ppf(np.random.uniform(size=n_samples)) \
+               if n_samples >0 else np.empty((0,))
 
 class Normal(StochVar):
     """
@@ -23,9 +47,24 @@ class Normal(StochVar):
 
     def __init__(self,input_prm_dict,*args):
         super().__init__(input_prm_dict,*args)
-        self.distribution=cp.Normal(self.mean,self.standard_deviation)
         self.parameters = [self.mean, self.standard_deviation]
 
+    @property
+    def distribution(self):
+        import chaospy as cp
+        return cp.Normal(self.mean,self.standard_deviation)
+
+    def ppf(self,u):
+        from scipy.special import ndtri
+        return self.mean + self.standard_deviation*ndtri(u)
+
+    def cdf(self,x):
+        from scipy.special import ndtr
+        return ndtr((np.asarray(x)-self.mean)/self.standard_deviation)
+
+    def mirror(self,x):
+        return 2.*self.mean - np.asarray(x)
+
     def draw_samples(self,n_samples):
         return np.random.normal(self.mean,self.standard_deviation,n_samples) \
                if n_samples >0 else np.empty((0,))
@@ -45,9 +84,144 @@ class Uniform(StochVar):
 
     def __init__(self,input_prm_dict,*args):
         super().__init__(input_prm_dict,*args)
-        self.distribution= cp.Uniform(self.bounds[0],self.bounds[1])
         self.parameters = self.bounds
 
+    @property
+    def distribution(self):
+        import chaospy as cp
+        return cp.Uniform(self.bounds[0],self.bounds[1])
+
+    def ppf(self,u):
+        return self.bounds[0] + (self.bounds[1]-self.bounds[0])*np.asarray(u)
+
+    def cdf(self,x):
+        return (np.asarray(x)-self.bounds[0])/(self.bounds[1]-self.bounds[0])
+
+    def mirror(self,x):
+        return self.bounds[0] + self.bounds[1] - np.asarray(x)
+
     def draw_samples(self,n_samples):
         return np.random.uniform(self.bounds[0],self.bounds[1],n_samples) \
                if n_samples >0 else np.empty((0,))
+
+
+class LogNormal(StochVar):
+    """
+    log-normal distribution, i.e. the logarithm of the variable is 
+    normally distributed with log_mean and log_standard_deviation
+    uses numpy, scipy and chaospy routines
+    """
+
+    cname = "lognormal"
+
+    defaults_ = {
+        'log_mean' : 'NODEFAULT',
+        'log_standard_deviation' : 'NODEFAULT',
+        }
+
+    def __init__(self,input_prm_dict,*args):
+        super().__init__(input_prm_dict,*args)
+        self.parameters = [self.log_mean, self.log_standard_deviation]
+
+    @property
+    def distribution(self):
+        import chaospy as cp
+        return cp.LogNormal(self.log_mean,self.log_standard_deviation)
+
+    def ppf(self,u):
+        from scipy.special import ndtri
+        return np.exp(self.log_mean + self.log_standard_deviation*ndtri(u))
+
+    def cdf(self,x):
+        from scipy.special import ndtr
+        with np.errstate(divide="ignore"): 
+            return ndtr((np.log(x)-self.log_mean)/self.log_standard_deviation)
+
+    def draw_samples(self,n_samples):
+        return np.random.lognormal(self.log_mean,self.log_standard_deviation,n_samples) \
+               if n_samples >0 else np.empty((0,))
+
+
+class Beta(StochVar):
+    """
+    beta distribution with shape parameters alpha and beta, scaled 
+    to the given bounds
+    uses numpy, scipy and chaospy routines
+    """
+
+    cname = "beta"
+
+    defaults_ = {
+        'alpha' : 'NODEFAULT',
+        'beta' : 'NODEFAULT',
+        'bounds' : [0.,1.]
+        }
+
+    def __init__(self,input_prm_dict,*args):
+        super().__init__(input_prm_dict,*args)
+        self.parameters = [self.alpha, self.beta] + list(self.bounds)
+
+    @property
+    def distribution(self):
+        import chaospy as cp
+        return cp.Beta(self.alpha,self.beta,self.bounds[0],self.bounds[1])
+
+    def ppf(self,u):
+        from scipy.special import betaincinv
+        return self.bounds[0] + (self.bounds[1]-self.bounds[0])*betaincinv(self.alpha,self.beta,u)
+
+    def cdf(self,x):
+        from scipy.special import betainc
+        t = (np.asarray(x)-self.bounds[0])/(self.bounds[1]-self.bounds[0])
+        return betainc(self.alpha,self.beta,np.clip(t,0.,1.))
+
+    def mirror(self,x):
+        if self.alpha == self.beta: 
+            return self.bounds[0] + self.bounds[1] - np.asarray(x)
+        return super().mirror(x)
+
+    def draw_samples(self,n_samples):
+        return self.bounds[0] + (self.bounds[1]-self.bounds[0]) \
+                                *np.random.beta(self.alpha,self.beta,n_samples) \
+               if n_samples >0 else np.empty((0,))
+
+
+class TruncatedNormal(StochVar):
+    """
+    normal distribution truncated to the given bounds (mean and 
+    standard_deviation of the normal distribution before truncation)
+    uses scipy and chaospy routines
+    """
+
+    cname = "truncated_normal"
+
+    defaults_ = {
+        'mean' : 'NODEFAULT',
+        'standard_deviation' : 'NODEFAULT',
+        'bounds' : 'NODEFAULT'
+        }
+
+    def __init__(self,input_prm_dict,*args):
+        super().__init__(input_prm_dict,*args)
+        self.parameters = [self.mean, self.standard_deviation] + list(self.bounds)
+
+    @property
+    def distribution(self):
+        import chaospy as cp
+        return cp.TruncNormal(self.bounds[0],self.bounds[1],self.mean,self.standard_deviation)
+
+    def cdf_bounds(self): 
+        from scipy.special import ndtr
+        return ndtr((np.asarray(self.bounds)-self.mean)/self.standard_deviation)
+
+    def ppf(self,u):
+        from scipy.special import ndtri
+        lo, hi = self.cdf_bounds()
+        x = self.mean + self.standard_deviation*ndtri(lo + (hi-lo)*np.asarray(u))
+        return np.clip(x,self.bounds[0],self.bounds[1])
+
+    def cdf(self,x):
+        from scipy.special import ndtr
+        lo, hi = self.cdf_bounds()
+        x = np.clip(x,self.bounds[0],self.bounds[1])
+        return (ndtr((x-self.mean)/self.standard_deviation)-lo)/(hi-lo)
@@ -1,6 +1,21 @@
 from helpers import config
+from helpers import globels
 from helpers.printtools import *
+from helpers.cache import QuadratureCache
+from helpers.moments import StreamingMoments
+from helpers.checkpoint import Checkpoint
+from helpers.archive import Archiver
+from sampling.store import SampleStore
+from machine.local import Local
+from machine.scheduler import Scheduler
+from solver.solver import Solver
 import numpy as np
+import os
+import pickle
+import types
+import tarfile
+import yaml
+import pytest
 
 
 def run_pounce_simple(prmfile):
@@ -26,6 +41,332 @@ def test_internal_mlmc():
     tol = 1.E-7
     general_tst(prmfile,mean_ref,stddev_ref,tol)
 
+def test_internal_mlmc_restart():
+    # continue the simulation from a record in the middle of the 
+    # checkpoint journal
+    prmfile    = "../ini/internal_local/parameter_mlmc.yml"
+    mean_ref   = -0.03819458024853564
+    stddev_ref = 0.6905427902794208
+    tol = 1.E-7
+    general_tst(prmfile,mean_ref,stddev_ref,tol)
+    _, sim = globels.checkpoint.load(len(globels.checkpoint)//2)
+    globels.sim = sim
+    sim.run()
+    assert np.abs(sim.mean - mean_ref) < tol
+    assert np.abs(sim.stddev - stddev_ref) < tol
+
+def test_checkpoint_compact(tmp_path):
+    # a growing array is written in every step; after compaction, only
+    # the last record of each iteration and its arrays are kept
+    checkpoint = Checkpoint(str(tmp_path/"checkpoint"))
+    u = np.zeros(10000)
+    for n_iter in range(1,4): 
+        for n_step in range(3): 
+            u = np.append(u,float(n_step))
+            checkpoint.write({"u": u},(n_iter,n_step))
+            checkpoint.flush()
+    assert len(os.listdir(tmp_path/"checkpoint"/"arrays")) == 9
+    checkpoint.compact()
+    assert len(checkpoint) == 3
+    assert len(os.listdir(tmp_path/"checkpoint"/"arrays")) == 3
+    info, state = checkpoint.load()
+    assert info == (3,2) and np.array_equal(state["u"],u)
+    checkpoint.reset()
+    assert not os.listdir(tmp_path/"checkpoint"/"arrays")
+
+def test_checkpoint_tracked_arrays(tmp_path):
+    # journaled arrays are frozen and only written once; loaded arrays
+    # are read-only memory maps, which are not written again
+    checkpoint = Checkpoint(str(tmp_path/"checkpoint"))
+    state = {"u": np.arange(10000.), "v": np.zeros(10000)}
+    checkpoint.write(state,(1,0))
+    assert not state["u"].flags.writeable
+    state["v"] = state["v"] + 1.
+    checkpoint.write(state,(1,1))
+    checkpoint.flush()
+    assert len(os.listdir(tmp_path/"checkpoint"/"arrays")) == 3
+    checkpoint = Checkpoint(str(tmp_path/"checkpoint"))
+    info, state = checkpoint.load()
+    assert info == (1,1) and np.all(state["v"] == 1.)
+    assert isinstance(state["u"],np.memmap) and not state["u"].flags.writeable
+    checkpoint.write(state,(1,2))
+    checkpoint.compact()
+    assert len(os.listdir(tmp_path/"checkpoint"/"arrays")) == 2
+
+def test_archive_truncated(tmp_path,monkeypatch):
+    # the checkpoint is excluded; truncated files are skipped
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("checkpoint")
+    for fn in ["log","checkpoint/journal"]: 
+        with open(fn,"wb") as f: 
+            f.write(bytes(1000))
+    archiver = Archiver()
+    assert list(archiver.files({"checkpoint"})) == ["log"]
+    changed = {"log": {"size": 1000}}
+    os.truncate("log",10)
+    with tarfile.open("test.tar","w") as tar: 
+        archiver.add_files(tar,changed)
+    assert not changed
+
+def test_longest_first(tmp_path,monkeypatch):
+    # the work of new samples is predicted from the nearest recorded 
+    # ones, and the longest jobs are started first
+    monkeypatch.chdir(tmp_path)
+    batch = types.SimpleNamespace(max_work_history=8,sum_work={},cores_per_sample=1)
+    Solver.record_sample_work(batch,np.linspace(1.,10.,11),np.linspace(0.,1.,11))
+    assert len(batch.work_history) == 8
+    batch.predict_sample_work = lambda nodes: Solver.predict_sample_work(batch,nodes)
+    assert np.allclose(batch.predict_sample_work([[0.3],[0.9]]),[3.7,9.1])
+    batch.samples = types.SimpleNamespace(nodes=np.array([[0.3],[0.9],[0.6]]),n=3)
+    batch.n_runs = 3
+    batch.run_commands = ["echo {} >> order.txt".format(i) for i in range(3)]
+    batch.logfile_names = ["log_{}.dat".format(i) for i in range(3)]
+    machine = Local({"parallelization": "pool"})
+    machine.fill("main",True)
+    scheduler = Scheduler(1)
+    for job in machine.make_jobs(batch): 
+        scheduler.add(job)
+    scheduler.run()
+    with open("order.txt") as f: 
+        assert f.read().split() == ["1","2","0"]
+
+def changed_prmfile(prmfile,new_prmfile,change):
+    with open(prmfile) as f: 
+        prms = yaml.safe_load(f)
+    change(prms)
+    with open(new_prmfile,"w") as f: 
+        yaml.safe_dump(prms,f)
+    return new_prmfile
+
+def test_internal_mlmc_pipeline(monkeypatch):
+    # both stages are run as one pipeline, with the same results
+    prmfile    = "../ini/internal_local/parameter_mlmc.yml"
+    mean_ref   = -0.03819458024853564
+    stddev_ref = 0.6905427902794208
+    tol = 1.E-7
+    def pipeline(prms): 
+        prms["general"]["main_stages"][1]["pipeline"] = True
+        prms["machine"]["parallelization"] = "pool"
+    run_pipeline = Local.run_pipeline
+    pipelines = []
+    def record(self,stages): 
+        pipelines.append([s.name for s in stages])
+        run_pipeline(self,stages)
+    monkeypatch.setattr(Local,"run_pipeline",record)
+    general_tst(changed_prmfile(prmfile,"parameter_mlmc_pipeline.yml",pipeline),mean_ref,stddev_ref,tol)
+    assert [s.name for s in globels.sim.stage_groups()[0]] == ["main","replica"]
+    assert pipelines and all(p == ["main","replica"] for p in pipelines)
+
+def test_internal_mlmc_restart_changed():
+    # raise total work and add a level on restart of a finished simulation
+    prmfile    = "../ini/internal_local/parameter_mlmc.yml"
+    sim = run_pounce_simple(prmfile)
+    n_finished = [l.samples.n_previous for l in sim.levels]
+    def change(prms): 
+        prms["uq_method"]["total_work"] = 400.
+        prms["solver"]["levels"].append({"n_pts": 64})
+    sim = config.restart(changed_prmfile(prmfile,"parameter_mlmc_changed.yml",change))
+    sim.run()
+    assert len(sim.levels) == 5
+    assert all(l.samples.n_previous >= n for l,n in zip(sim.levels,n_finished))
+    assert np.abs(sim.mean - -0.02239860506130518) < 1.E-7
+    assert np.abs(sim.stddev - 0.6966736821693006) < 1.E-7
+
+def test_internal_mfmc_restart_changed(monkeypatch):
+    # add a model after the pilot iteration: same result as with the model from the start
+    prmfile    = "../ini/internal_local/parameter_mfmc.yml"
+    mean_ref   = 0.022528934807061824
+    stddev_ref = 0.691569022875092
+    tol = 1.E-7
+    def remove_lf8(prms): 
+        prms["general"]["do_pickle"] = True
+        del prms["models"]["fidelities"][2]
+    Mfmc = config.UqMethod.subclass("mfmc")
+    get_samples = Mfmc.get_samples
+    def get_samples_abort(self,batches): 
+        if len(self.iterations) > 1: 
+            raise Exception("abort after pilot iteration")
+        get_samples(self,batches)
+    monkeypatch.setattr(Mfmc,"get_samples",get_samples_abort)
+    with pytest.raises(Exception,match="abort"): 
+        run_pounce_simple(changed_prmfile(prmfile,"parameter_mfmc_pilot.yml",remove_lf8))
+    monkeypatch.undo()
+    def do_pickle(prms): 
+        prms["general"]["do_pickle"] = True
+    sim = config.restart(changed_prmfile(prmfile,"parameter_mfmc_changed.yml",do_pickle))
+    sim.run()
+    assert np.abs(sim.mean - mean_ref) < tol
+    assert np.abs(sim.stddev - stddev_ref) < tol
+
+def test_internal_mlmc_dof_adj():
+    prmfile    = "../ini/internal_local/parameter_mlmc.yml"
+    mean_ref   = -0.04291613086286558
+    stddev_ref = 0.690209633094625
+    tol = 1.E-7
+    def dof_adj(prms): 
+        prms["uq_method"]["dof_adj"] = True
+    general_tst(changed_prmfile(prmfile,"parameter_mlmc_dof_adj.yml",dof_adj),mean_ref,stddev_ref,tol)
+
+def test_streaming_moments():
+    # merged moments of batches equal the moments of all samples
+    x = 1.E6 + np.random.default_rng(0).normal(size=(1000,3))
+    moments = StreamingMoments()
+    for batch in np.array_split(x,7): 
+        moments.update(batch)
+    d = x - np.mean(x,axis=0)
+    assert np.allclose(moments.mean,np.mean(x,axis=0),rtol=1.E-14)
+    assert np.allclose([moments.m2,moments.m3,moments.m4],
+                       [np.sum(d**2,axis=0),np.sum(d**3,axis=0),np.sum(d**4,axis=0)],rtol=1.E-6)
+    assert np.allclose(moments.var,np.var(x,axis=0,ddof=1))
+    # state from the sums of powers (of older simulations)
+    y = np.random.default_rng(1).normal(size=100)
+    moments = StreamingMoments.from_sums(len(y),*[np.sum(y**p) for p in range(1,5)])
+    assert np.isclose(moments.mean,np.mean(y)) and np.isclose(moments.var,np.var(y,ddof=1))
+    assert np.isclose(moments.m4,np.sum((y-np.mean(y))**4))
+
+def test_cache_unsupported():
+    # solvers without evaluation cache reject cache_file
+    prmfile = "../ini/internal_local/parameter_mlmc.yml"
+    def cache(prms): 
+        prms["solver"]["cache_file"] = "evaluations.sqlite"
+    with pytest.raises(Exception,match="cache_file"): 
+        config.config(changed_prmfile(prmfile,"parameter_mlmc_cache.yml",cache))
+
+def test_check_prmfile():
+    prmfile    = "../ini/internal_local/parameter_mlmc.yml"
+    config.check(prmfile)
+    def typo(prms): 
+        prms["uq_method"]["total_wrk"] = prms["uq_method"].pop("total_work")
+        prms["solver"]["levels"][1]["n_ptz"] = prms["solver"]["levels"][1].pop("n_pts")
+    with pytest.raises(Exception,match="total_wrk(.|\n)*n_ptz"): 
+        config.check(changed_prmfile(prmfile,"parameter_mlmc_typo.yml",typo))
+
+def test_internal_mlmc_philox():
+    prmfile    = "../ini/internal_local/parameter_mlmc.yml"
+    mean_ref   = -0.043094452886684384
+    stddev_ref = 0.6895315940661652
+    tol = 1.E-7
+    def philox(prms): 
+        prms["sampling"]["seed_mode"] = "philox"
+    general_tst(changed_prmfile(prmfile,"parameter_mlmc_philox.yml",philox),mean_ref,stddev_ref,tol)
+    # samples do not depend on the iteration they are drawn in
+    samples = globels.sim.levels[0].samples
+    n_total = samples.n_previous
+    samples.n, samples.n_previous = n_total, 0
+    samples.get()
+    nodes_all = samples.nodes
+    samples.n, samples.n_previous = n_total-7, 7
+    samples.get()
+    assert np.array_equal(samples.nodes,nodes_all[7:])
+
+def test_internal_mlmc_qmc(monkeypatch):
+    prmfile    = "../ini/internal_local/parameter_mlmc.yml"
+    mean_ref   = -0.049460627536554204
+    stddev_ref = 0.6904247334078227
+    tol = 1.E-7
+    def qmc(prms): 
+        prms["sampling"]["_type"] = "quasi_monte_carlo"
+    general_tst(changed_prmfile(prmfile,"parameter_mlmc_qmc.yml",qmc),mean_ref,stddev_ref,tol)
+    # later iterations continue the sequence
+    samples = globels.sim.levels[0].samples
+    nodes_last = samples.nodes
+    samples.n, samples.n_previous = samples.n_previous+samples.n, 0
+    samples.get()
+    assert np.allclose(samples.nodes[-len(nodes_last):],nodes_last)
+    # scipy < 1.15 only accepts seed (instead of rng)
+    from scipy.stats import qmc as scipy_qmc
+    class OldSobol(scipy_qmc.Sobol): 
+        def __init__(self,d,scramble=True,seed=None): 
+            super().__init__(d,scramble=scramble,rng=seed)
+    monkeypatch.setattr(scipy_qmc,"Sobol",OldSobol)
+    nodes_new = samples.nodes
+    samples.get()
+    assert np.array_equal(samples.nodes,nodes_new)
+
+def test_internal_mlmc_antithetic():
+    prmfile    = "../ini/internal_local/parameter_mlmc.yml"
+    mean_ref   = -0.03331991829576376
+    stddev_ref = 0.6909028763903836
+    tol = 1.E-7
+    def antithetic(prms): 
+        prms["sampling"]["antithetic"] = True
+    general_tst(changed_prmfile(prmfile,"parameter_mlmc_antithetic.yml",antithetic),mean_ref,stddev_ref,tol)
+    # every second sample is mirrored at the center of [-1,1]
+    for level in globels.sim.levels:
+        nodes = level.samples.nodes
+        assert len(nodes) % 2 == 0
+        assert np.allclose(nodes[1::2],-nodes[0::2])
+
+def test_internal_mfmc_antithetic():
+    prmfile    = "../ini/internal_local/parameter_mfmc.yml"
+    mean_ref   = -0.08184926050403517
+    stddev_ref = 0.5635580216643099
+    tol = 1.E-7
+    def antithetic(prms): 
+        prms["sampling"]["antithetic"] = True
+    general_tst(changed_prmfile(prmfile,"parameter_mfmc_antithetic.yml",antithetic),mean_ref,stddev_ref,tol)
+    nodes = np.asarray(globels.sim.sampling.nodes_all)
+    assert np.allclose(nodes[1::2],-nodes[0::2])
+    # odd pilot sample numbers are rejected during config
+    def odd(prms): 
+        antithetic(prms)
+        prms["uq_method"]["n_warmup_samples"] = 9
+    with pytest.raises(Exception,match="even"): 
+        config.config(changed_prmfile(prmfile,"parameter_mfmc_odd.yml",odd))
+
+def test_internal_mlmc_correlated():
+    prmfile    = "../ini/internal_local/parameter_mlmc.yml"
+    mean_ref   = -0.05811930763802341
+    stddev_ref = 0.6876258749369929
+    tol = 1.E-7
+    def correlated(prms): 
+        prms["sampling"].update({"seed_mode": "philox", "correlation": [[1.,0.9],[0.9,1.]]})
+        prms["stoch_vars"] = [{"_type": "truncated_normal", "mean": 0., "standard_deviation": 0.5, 
+                               "bounds": [-1.,1.]},
+                              {"_type": "lognormal", "log_mean": 0., "log_standard_deviation": 0.5}]
+    general_tst(changed_prmfile(prmfile,"parameter_mlmc_correlated.yml",correlated),mean_ref,stddev_ref,tol)
+    # rank correlation of the underlying normal variables
+    nodes = globels.sim.levels[0].samples.nodes
+    assert np.all(np.abs(nodes[:,0]) <= 1.) and np.all(nodes[:,1] > 0.)
+    ranks = np.argsort(np.argsort(nodes,axis=0),axis=0)
+    assert np.corrcoef(ranks.T)[0,1] > 0.7
+
+def test_internal_pce_correlated():
+    prmfile    = "../ini/internal_local/parameter_pce.yml"
+    mean_ref   = 0.3800852513215302
+    stddev_ref = 0.5947198244419528
+    tol = 1.E-7
+    def correlated(prms): 
+        prms["sampling"]["correlation"] = [[1.,0.5],[0.5,1.]]
+        prms["stoch_vars"] = [{"_type": "beta", "alpha": 2., "beta": 2., "bounds": [-0.5,1.]},
+                              {"_type": "normal", "mean": 0., "standard_deviation": 1.}]
+    general_tst(changed_prmfile(prmfile,"parameter_pce_correlated.yml",correlated),mean_ref,stddev_ref,tol)
+    # the weights integrate the correlation of the underlying normal variables
+    from scipy.special import ndtri
+    samples = globels.sim.samples
+    z = ndtri(samples.nodes_to_uniform(samples.nodes))
+    assert np.isclose(np.sum(samples.weights*z[:,0]*z[:,1]),0.5)
+
+def test_internal_mlqmc(monkeypatch):
+    prmfile    = "../ini/internal_local/parameter_mlmc.yml"
+    mean_ref   = -0.04976413229626146
+    stddev_ref = 0.6914845812391759
+    tol = 1.E-7
+    def mlqmc(prms): 
+        prms["uq_method"] = {"_type": "mlqmc", "total_work": 100., "n_max_iter": 4}
+        prms["sampling"]["n_replicates"] = 8
+        prms["solver"]["n_warmup_samples"] = 4
+    general_tst(changed_prmfile(prmfile,"parameter_mlqmc.yml",mlqmc),mean_ref,stddev_ref,tol)
+    # variance of the level estimators from the replicates
+    assert globels.sim.est_eps < 1.E-3
+    # levels without measured work are not doubled (zero cost)
+    sim = globels.sim
+    monkeypatch.setattr(type(sim.qois_optimize[0]),"work_mean",0.)
+    sim.current_iter = sim.iterations[-2] # last iteration before postproc
+    sim.n_max_iter = sim.current_iter.n + 1
+    sim.allocate_samples()
+    assert all(q.n_new_samples == 0 for q in sim.qois_optimize)
+
 def test_internal_mfmc():
     prmfile    = "../ini/internal_local/parameter_mfmc.yml"
     mean_ref   = 0.022528934807061824
@@ -33,6 +374,56 @@ def test_internal_mfmc():
     tol = 1.E-7
     general_tst(prmfile,mean_ref,stddev_ref,tol)
 
+def test_internal_mfmc_chunks():
+    prmfile    = "../ini/internal_local/parameter_mfmc.yml"
+    mean_ref   = 0.022528934807061824
+    stddev_ref = 0.691569022875092
+    tol = 1.E-7
+    def chunks(prms): 
+        prms["uq_method"]["sample_chunk_size"] = 7
+        prms["uq_method"]["sample_memory_mb"] = 0.
+        prms["general"]["do_pickle"] = True
+    general_tst(changed_prmfile(prmfile,"parameter_mfmc_chunks.yml",chunks),mean_ref,stddev_ref,tol)
+    # samples are the same as without chunks, stored memory-mapped
+    store = globels.sim.sampling.nodes_all
+    assert isinstance(store.chunks[-1],np.memmap)
+    assert store.dirname == os.path.join("samples","mfmc_mfmc")
+    assert sum(len(c) for c in store.iter_chunks()) == len(store)
+    # pickled as references to the files, which are re-opened
+    assert all(isinstance(c,tuple) for c in store.__getstate__()["chunks"])
+    restored = pickle.loads(pickle.dumps(store))
+    assert restored.chunks[-1].mode == "r+"
+    assert np.array_equal(np.asarray(restored),np.asarray(store))
+
+def test_sample_store(tmp_path):
+    # in memory, chunks grow geometrically; files are removed at the end
+    # (two chunks of 8 rows in memory, the third one memory-mapped)
+    store = SampleStore(2,chunk_size=8,max_memory_mb=3.E-4,dirname=str(tmp_path/"samples"))
+    nodes = np.random.random((20,2))
+    store.append(nodes[:3])
+    assert len(store.chunks[0]) == 3
+    store.append(nodes[3:5])
+    assert len(store.chunks[0]) == 6
+    store.append(nodes[5:20])
+    assert [len(c) for c in store.chunks] == [8,8,8]
+    assert isinstance(store.chunks[-1],np.memmap)
+    assert np.array_equal(np.asarray(store),nodes)
+    store.remove_files()
+    assert not os.path.exists(tmp_path/"samples")
+
+def test_internal_mfmc_lhs():
+    prmfile    = "../ini/internal_local/parameter_mfmc.yml"
+    mean_ref   = -0.06862138627512472
+    stddev_ref = 0.7055557851204806
+    tol = 1.E-7
+    def lhs(prms): 
+        prms["sampling"]["_type"] = "latin_hypercube"
+    general_tst(changed_prmfile(prmfile,"parameter_mfmc_lhs.yml",lhs),mean_ref,stddev_ref,tol)
+    # the pilot samples are a Latin hypercube: one sample per stratum
+    n_warmup = globels.sim.n_warmup_samples
+    u_pilot = (globels.sim.sampling.nodes_all[:n_warmup,0]+1.)/2.
+    assert np.array_equal(np.sort(np.floor(u_pilot*n_warmup)),np.arange(n_warmup))
+
 def test_internal_pce():
     prmfile    = "../ini/internal_local/parameter_pce.yml"
     mean_ref   = 0.2101817993546256
@@ -40,6 +431,38 @@ def test_internal_pce():
     tol = 1.E-7
     general_tst(prmfile,mean_ref,stddev_ref,tol)
 
+def test_internal_pce_adaptive():
+    prmfile    = "../ini/internal_local/parameter_pce.yml"
+    mean_ref   = 0.21018181368961686
+    stddev_ref = 0.6743134746551847
+    tol = 1.E-7
+    def adaptive(prms): 
+        prms["uq_method"]["n_max_iter"] = 10
+        prms["sampling"] = {"_type": "adaptive_sparse_grid", "tol": 1.E-8}
+        prms["stoch_vars"].append({"_type": "uniform", "bounds": [0.,1.]})
+    general_tst(changed_prmfile(prmfile,"parameter_pce_adaptive.yml",adaptive),mean_ref,stddev_ref,tol)
+    # only the first variable is refined, nested nodes are re-used
+    samples = globels.sim.samples
+    assert all(index[1] == 0 for index in samples.old)
+    assert len(samples.nodes_all) == len(np.unique(samples.nodes_all,axis=0))
+    assert len(globels.sim.iterations) < 10
+
+def test_internal_pce_quadrature_cache():
+    prmfile    = "../ini/internal_local/parameter_pce.yml"
+    mean_ref   = 0.2101817993546256
+    stddev_ref = 0.6743135688310626
+    tol = 1.E-7
+    def cache(prms): 
+        prms["sampling"]["quadrature_cache"] = "quadrature_cache"
+    prmfile = changed_prmfile(prmfile,"parameter_pce_cache.yml",cache)
+    QuadratureCache.memory.clear()
+    general_tst(prmfile,mean_ref,stddev_ref,tol)
+    assert len(os.listdir("quadrature_cache")) == 2
+    # second run: rule is loaded memory-mapped from disk
+    QuadratureCache.memory.clear()
+    general_tst(prmfile,mean_ref,stddev_ref,tol)
+    assert isinstance(globels.sim.samples.nodes,np.memmap)
+
 
 def test_demonstrator_single_mlmc():
     prmfile    = "../ini/demonstrator_single_local/parameter_mlmc.yml"
@@ -55,6 +478,55 @@ def test_demonstrator_single_mfmc():
     tol = 1.E-7
     general_tst(prmfile,mean_ref,stddev_ref,tol)
 
+def test_demonstrator_single_mlmc_pool():
+    prmfile    = "../ini/demonstrator_single_local/parameter_mlmc_pool.yml"
+    mean_ref   = -0.012229132342988919
+    stddev_ref = 0.6693207229012809   
+    tol = 1.E-7
+    general_tst(prmfile,mean_ref,stddev_ref,tol)
+
+def test_demonstrator_single_mlmc_cache():
+    # second run: all samples are taken from the evaluation cache
+    prmfile    = "../ini/demonstrator_single_local/parameter_mlmc_cache.yml"
+    mean_ref   = -0.012229132342988919
+    stddev_ref = 0.6693207229012809   
+    tol = 1.E-7
+    # the first run must not find cached samples of earlier test runs
+    if os.path.isfile("evaluations_mlmc.sqlite"): 
+        os.remove("evaluations_mlmc.sqlite")
+    general_tst(prmfile,mean_ref,stddev_ref,tol)
+    assert not any(batch.cached for batch in globels.sim.stages[0].batches)
+    general_tst(prmfile,mean_ref,stddev_ref,tol)
+    assert all(batch.cached for batch in globels.sim.stages[0].batches)
+
+def test_demonstrator_single_mlmc_slurm(monkeypatch,tmp_path):
+    # stubs of sbatch, squeue and sacct; the first array element 
+    # times out and is re-submitted.
+    stubs = os.path.abspath("../externals/slurm_stubs")
+    monkeypatch.setenv("PATH",stubs+os.pathsep+os.environ["PATH"])
+    monkeypatch.setenv("SLURM_STUB_DIR",str(tmp_path))
+    monkeypatch.setenv("SLURM_STUB_FAIL_ONCE","TIMEOUT")
+    prmfile    = "../ini/demonstrator_single_slurm/parameter_mlmc.yml"
+    mean_ref   = -0.012229132342988919
+    stddev_ref = 0.6693207229012809   
+    tol = 1.E-7
+    general_tst(prmfile,mean_ref,stddev_ref,tol)
+    # the element which timed out was submitted again on its own
+    failed = (tmp_path/"failed_once").read_text().split()
+    submissions = [line.split()[1].split(",") for line in (tmp_path/"submissions").read_text().splitlines()]
+    assert failed and failed in submissions[1:]
+
+def test_demonstrator_single_mlmc_slurm_remote(monkeypatch,tmp_path):
+    # as above, with all Slurm commands sent to one persistent shell
+    stubs = os.path.abspath("../externals/slurm_stubs")
+    monkeypatch.setenv("PATH",stubs+os.pathsep+os.environ["PATH"])
+    monkeypatch.setenv("SLURM_STUB_DIR",str(tmp_path))
+    prmfile    = "../ini/demonstrator_single_slurm/parameter_mlmc_remote.yml"
+    mean_ref   = -0.012229132342988919
+    stddev_ref = 0.6693207229012809   
+    tol = 1.E-7
+    general_tst(prmfile,mean_ref,stddev_ref,tol)
+
 def test_demonstrator_single_pce():
     prmfile    = "../ini/demonstrator_single_local/parameter_pce.yml"
     mean_ref   = 0.2101817993546256
@@ -83,3 +555,30 @@ def test_demonstrator_batch_pce():
     stddev_ref = 0.6743135688310626
     tol = 1.E-7
     general_tst(prmfile,mean_ref,stddev_ref,tol)
+
+
+def test_demonstrator_inprocess_mlmc():
+    prmfile    = "../ini/demonstrator_inprocess_local/parameter_mlmc.yml"
+    mean_ref   = -0.012229132342988919
+    stddev_ref = 0.6693207229012809   
+    tol = 1.E-7
+    general_tst(prmfile,mean_ref,stddev_ref,tol)
+
+def test_demonstrator_inprocess_mfmc():
+    prmfile    = "../ini/demonstrator_inprocess_local/parameter_mfmc.yml"
+    mean_ref   = 0.2953688589647575
+    stddev_ref = 0.5491082357659686
+    tol = 1.E-7
+    general_tst(prmfile,mean_ref,stddev_ref,tol)
+    # the model name of the HF model from the parameter file
+    def prmfile_hf(prms): 
+        prms["models"]["prmfile"] = "../ini/demonstrator_single_local/parameter.ini"
+        del prms["models"]["fidelities"][0]["solver_prms"]
+    general_tst(changed_prmfile(prmfile,"parameter_mfmc_prmfile.yml",prmfile_hf),mean_ref,stddev_ref,tol)
+
+def test_demonstrator_inprocess_pce():
+    prmfile    = "../ini/demonstrator_inprocess_local/parameter_pce.yml"
+    mean_ref   = 0.2101817993546256
+    stddev_ref = 0.6743135688310626
+    tol = 1.E-7
+    general_tst(prmfile,mean_ref,stddev_ref,tol)
@@ -10,10 +10,12 @@ from .uqmethod import UqMethod
 from helpers.printtools import *
 from helpers.tools import *
 from sampling.sampling import MonteCarlo
+from sampling.store import SampleStore
 from solver.solver import Solver,register_batch_series
 from machine.machine import Machine
 from stochvar.stochvar import StochVar
 from helpers import config
+from helpers import globels
 
 
 
@@ -32,13 +34,21 @@ class Mfmc(UqMethod):
 
     cname = "mfmc"
 
+    SamplingMethod = MonteCarlo
+    solver_section = "models"
+    solver_sub_list = "fidelities"
+
     defaults_ = {
         "total_work" : "NODEFAULT",           # computational budget
         "n_warmup_samples": "NODEFAULT",      # pilot sample size
         "reuse_warmup_samples": False,        # reuse pilot simulations for estimators
-        "update_alpha": False                 # update CV coefficients
+        "update_alpha": False,                # update CV coefficients
+        "sample_chunk_size": 100000,          # samples are drawn and stored in chunks of this size
+        "sample_memory_mb": None              # above this size, samples are stored in memory-mapped files
         }
 
+    restart_fixed_prms = ["n_warmup_samples", "reuse_warmup_samples"]
+
     defaults_add = { 
         "Solver": { 
             "name": "NODEFAULT",              # models are named to be distinguished in MFMC 
@@ -61,6 +71,7 @@ class Mfmc(UqMethod):
 
         self.has_simulation_postproc = True
         self.n_max_iter = 2
+        self.n_pilot_iter = 1
         self.has_simulation_postproc = False
         if self.update_alpha and not self.reuse_warmup_samples: 
             raise Exception("update alpha only possible if warmup samples are resued!")
@@ -88,7 +99,7 @@ class Mfmc(UqMethod):
         sampling_prms = prms["sampling"] if "sampling" in prms else {}
         for subdict in prms_models: 
             if subdict.get("is_auxiliary"):
-                sampler = MonteCarlo(sampling_prms)
+                sampler = self.SamplingMethod.create(sampling_prms)
             else: 
                 sampler = Empty()
                 sampler.n = self.n_warmup_samples
@@ -112,9 +123,12 @@ class Mfmc(UqMethod):
         self.hfm = all_models[0]
 
         # common sample drawing, from which samples for models are taken
-        self.sampling = MonteCarlo(sampling_prms)
+        self.sampling = self.SamplingMethod.create(sampling_prms)
+        if self.antithetic and self.n_warmup_samples % 2: 
+            raise InputPrmError("n_warmup_samples has to be even for antithetic sampling.")
         self.sampling.seed_id = 0
-        self.sampling.nodes_all = np.empty((0,len(self.stoch_vars)))
+        self.sampling.nodes_all = SampleStore(len(self.stoch_vars),self.sample_chunk_size,
+                                              self.sample_memory_mb,self.sample_dirname())
         self.sampling.stoch_vars = self.stoch_vars
 
         # set up stages 
@@ -146,6 +160,90 @@ class Mfmc(UqMethod):
                 qoi.participants = [sm, im, im.qois[i_qoi]]
 
 
+    def apply_prm_changes(self, new):
+        """
+        Restart with a changed parameter file. Models are matched by 
+        their name. 
+        After the pilot iteration, models can be added: their pilot 
+        samples are computed in a further iteration, then the model
+        selection is repeated. 
+        A changed total work is applied at the end of an iteration by
+        re-computing the optimal sample sizes of the selected models
+        (the selection itself does not depend on the total work). If
+        the main iteration is finished already, only the additional 
+        samples are computed in a further iteration.
+        """
+        changed = self.changed_prms(new)
+        super().apply_prm_changes(new)
+
+        at_iter_end = self.current_iter is None or self.current_iter.finished \
+                or "Prepare next iteration" in self.current_iter.finished_steps
+        n_pilot_iter = getattr(self,"n_pilot_iter",1)
+        names = [m.name for m in self.all_models]
+        if set(names) - {m.name for m in new.all_models}: 
+            raise InputPrmError("Models cannot be removed on restart.")
+        new_models = [m for m in new.all_models if m.name not in names]
+
+        for stage, stage_new in zip(self.stages,new.stages): 
+            models = {m.name:m for m in stage.all_models}
+            for model in stage_new.all_models: 
+                if model.name in models: 
+                    self.update_batch(models[model.name],model)
+
+        if new_models: 
+            if any(m.is_auxiliary or m.is_surrogate for m in new_models): 
+                raise InputPrmError("Auxiliary and surrogate models cannot be added on restart.")
+            if not (at_iter_end and len(self.iterations) == n_pilot_iter): 
+                raise InputPrmError("Models can only be added at the end of the pilot iteration.")
+            p_print("Add model(s) "+", ".join(m.name for m in new_models)
+                    +". Their pilot samples are computed in a further iteration.")
+            for stage, stage_new in zip(self.stages,new.stages): 
+                models = {m.name:m for m in stage.all_models}
+                stage.all_models = [models.get(m.name,m) for m in stage_new.all_models]
+                stage.batches = [b for b in stage.all_models if not b.is_surrogate]
+            register_batch_series(self.stages)
+            for model in new_models: 
+                model.samples.stoch_vars = self.stoch_vars
+            # only the new models are evaluated on the pilot samples
+            for model in self.all_models: 
+                model.samples.n = 0
+            all_models = self.stages[-1].all_models
+            self.auxiliaries = [b for b in all_models if b.is_auxiliary]
+            self.surrogates = [b for b in all_models if b.is_surrogate]
+            self.models = [b for b in all_models if not b.is_auxiliary]
+            self.all_models = self.auxiliaries \
+                + [b for b in self.models if not b.is_surrogate] + self.surrogates
+            self.n_pilot_iter = n_pilot_iter+1
+            self.n_max_iter += 1
+            self.iter_loop_finished = False
+            return
+
+        if not (at_iter_end and len(self.iterations) >= n_pilot_iter and "total_work" in changed): 
+            return
+
+        if len(self.iterations) > n_pilot_iter: 
+            # samples of the main iteration(s) are kept
+            for m in self.all_models: 
+                m.samples.n_previous += m.samples.n
+            self.n_max_iter = len(self.iterations)+1
+            self.iter_loop_finished = False
+
+        rv = [q.r for q in self.qois_optimize]
+        wv = [q.work_mean_static for q in self.qois_optimize]
+        mlopt1 = self.total_work/np.dot(rv, wv)
+        p_print("\nOptimal number of samples for new total work:")
+        table = PrettyTable()
+        table.field_names = ["Model","M_opt","finished Samples","new Samples"]
+        for m in self.all_models: 
+            m.samples.n = 0
+        for m, q in zip(self.models_opt,self.qois_optimize): 
+            q.mlopt = self.round_samples(mlopt1*q.r)
+            m.samples.n = max(q.mlopt - m.samples.n_previous, 0)
+            table.add_row([m.name,q.mlopt,m.samples.n_previous,m.samples.n])
+        print_table(table)
+        self.total_cost = np.dot(wv, [q.mlopt for q in self.qois_optimize])
+
+
     def setup_qoi(self, subdict, model, QoILoc):
         """ 
         set up and initialize quantity of interest for a model
@@ -167,17 +265,51 @@ class Mfmc(UqMethod):
         qoi.is_surrogate = model.is_surrogate
 
 
+    @property
+    def antithetic(self): 
+        return getattr(self.sampling,"antithetic",False)
+
+    def round_samples(self,n): 
+        """
+        round sample number (to pairs for antithetic sampling)
+        """
+        return 2*int(round(n/2.)) if self.antithetic else int(round(n))
+
+
+    def sample_dirname(self):
+        """
+        directory of the memory-mapped samples (unique per project)
+        """
+        return os.path.join("samples",globels.project_name+"_"+self.cname)
+
+
+    def remove_temporary_files(self):
+        if isinstance(self.sampling.nodes_all,SampleStore): 
+            self.sampling.nodes_all.remove_files()
+
+
     def get_samples(self,dummy):
         """
         Overwrites parent class routine. 
         In MFMC, samples are re-used across models.
         Samples are therefore only drawn once, and then distributed to the models.
         """
-        self.sampling.n = np.max([m.samples.n for m in self.models])
-        if self.sampling.n > 0: 
-            self.sampling.n_previous = self.sampling.nodes_all.shape[0]
+        chunk_size = getattr(self,"sample_chunk_size",100000)
+        if self.antithetic: 
+            chunk_size -= chunk_size % 2
+        if isinstance(self.sampling.nodes_all,np.ndarray): 
+            # restart of an older version
+            self.sampling.nodes_all = SampleStore.from_array(self.sampling.nodes_all,
+                                                             chunk_size=chunk_size,
+                                                             dirname=self.sample_dirname())
+        # samples are drawn chunk by chunk
+        n = np.max([m.samples.n for m in self.models])
+        for i in range(0,n,chunk_size): 
+            self.sampling.n = min(chunk_size,n-i)
+            self.sampling.n_previous = len(self.sampling.nodes_all)
             self.sampling.get()
-        self.sampling.nodes_all = np.concatenate((self.sampling.nodes_all, self.sampling.nodes))
+            self.sampling.nodes_all.append(self.sampling.nodes)
+        self.sampling.n = n
         for m in self.all_models:
             if m.is_auxiliary: 
                 m.samples.get()
@@ -188,19 +320,24 @@ class Mfmc(UqMethod):
 
 
     @staticmethod
-    def get_rho(n,qoi,qoi_hfm):
+    def get_rho(n,qoi,qoi_hfm,antithetic=False):
         """
         Calculate square of correlation coeficient between given LF modeli QoI and HF model QoI.
         POUNCE allows vectorial QoIs, for which an integration method is provided.
         The integration corresponds to a weighting of the components
+        For antithetic sampling, the means of the pairs are the samples, 
+        the variances are still given per model evaluation.
         """
-        qoi.u_sum      = np.sum(qoi.u[:n],axis=0)
-        qoi.u_sq_sum   = np.sum(qoi.u[:n]**2,axis=0)
-        qoi.u_uhfm_sum = np.sum(qoi.u[:n]*qoi_hfm.u[:n],axis=0)
+        u, u_hfm, k = qoi.u[:n], qoi_hfm.u[:n], 1
+        if antithetic: 
+            u, u_hfm, n, k = antithetic_means(u), antithetic_means(u_hfm), n//2, 2
+        qoi.u_sum      = np.sum(u,axis=0)
+        qoi.u_sq_sum   = np.sum(u**2,axis=0)
+        qoi.u_uhfm_sum = np.sum(u*u_hfm,axis=0)
 
         # calculate field-valued quantities
-        qoi.sigma_sq_field = (qoi.u_sq_sum - (qoi.u_sum**2 / n)) / (n-1)
-        enumerator  = (qoi.u_uhfm_sum - qoi.u_sum*qoi_hfm.u_sum/n) / (n-1.)
+        qoi.sigma_sq_field = k*(qoi.u_sq_sum - (qoi.u_sum**2 / n)) / (n-1)
+        enumerator  = k*(qoi.u_uhfm_sum - qoi.u_sum*qoi_hfm.u_sum/n) / (n-1.)
         denominator = safe_sqrt(qoi.sigma_sq_field * qoi_hfm.sigma_sq_field)
         # sanity check with fallback to rho=1 for sigma = 0 or very small, 
         # where correlation coefficient is not defined.
@@ -224,7 +361,7 @@ class Mfmc(UqMethod):
         at the end of iteration 2. 
         This routine therefore is different depending on the iteration count.
         """
-        if len(self.iterations) == 1: 
+        if len(self.iterations) <= getattr(self,"n_pilot_iter",1): 
             # calculate optimal configuration (between pilot simulations and main simulations)
 
             # create dummy "very low fidelity" model to append to list of models
@@ -241,11 +378,14 @@ class Mfmc(UqMethod):
                 # get QoI response for all sample points, get correlation coefficients.
                 for model in self.all_models: 
                     qoi = model.internal_qois[i]
-                    qoi.u = qoi.get_response()[0]
-                    qoi.work_mean_static = qoi.work_mean
+                    # models added on restart are evaluated in a further pilot
+                    # iteration, the others keep their pilot responses
+                    if model.samples.n > 0: 
+                        qoi.u = qoi.get_response()[0]
+                        qoi.work_mean_static = qoi.work_mean
                     if model.is_auxiliary: 
                         continue
-                    self.get_rho(self.sampling.n,qoi,qoi_hfm)
+                    self.get_rho(self.sampling.n,qoi,qoi_hfm,self.antithetic)
                     qoi.om_rho_sq = 1. - qoi.rho_sq
 
                 # print info to stdout
@@ -292,7 +432,7 @@ class Mfmc(UqMethod):
                 table.field_names = ["Model","M_opt","alpha"]
                 for m, q in zip(models_opt,qois_opt): 
                     mlopt = mlopt1*q.r
-                    q.mlopt = int(round(mlopt))
+                    q.mlopt = self.round_samples(mlopt)
                     # for values > 1, the integer mlopt is the relevant information. 
                     # for values < 1, the exact value gives more information than a plain 0.
                     mlopt_print = q.mlopt if q.mlopt > 1 else mlopt
@@ -316,7 +456,7 @@ class Mfmc(UqMethod):
             # update sample size
             if self.reuse_warmup_samples: 
                 for m in self.all_models: 
-                    m.samples.n_previous = m.samples.n
+                    m.samples.n_previous += m.samples.n
                 self.sampling.n_previous = self.sampling.n
             for m in self.all_models: 
                 m.samples.n = 0
@@ -332,8 +472,9 @@ class Mfmc(UqMethod):
                     # no new evaluations since pilot samples, as mlopt < ml_pilot
                     continue
                 for qoi in model.internal_qois: 
-                    if self.reuse_warmup_samples: 
-                        qoi.u = np.concatenate((qoi.u,qoi.get_response()[0]))
+                    if model.samples.n_previous > 0: 
+                        # re-used pilot samples or samples of previous iterations
+                        qoi.u = np.concatenate((qoi.u[:model.samples.n_previous],qoi.get_response()[0]))
                     else: 
                         qoi.u = qoi.get_response()[0]
                     qoi.work_mean_static = qoi.work_mean
@@ -355,7 +496,7 @@ class Mfmc(UqMethod):
                         if model.is_auxiliary: 
                             continue
                         q = m.internal_qois[i]
-                        self.get_rho(n_hfm,q,qoi_hfm)
+                        self.get_rho(n_hfm,q,qoi_hfm,self.antithetic)
                         q.alpha = safe_sqrt(q.rho_sq * qoi_hfm.sigma_sq / q.sigma_sq)
 
                 u = qoi_hfm.u[:n_hfm+1]#.astype(np.float64)
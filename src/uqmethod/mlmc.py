@@ -2,11 +2,11 @@ import numpy as np
 import os
 import copy
 from prettytable import PrettyTable
-from scipy.stats import chi2, norm
 
 from .uqmethod import UqMethod
 from helpers.printtools import *
 from helpers.tools import *
+from helpers.moments import StreamingMoments
 from sampling.sampling import MonteCarlo
 from solver.solver import Solver,register_batch_series
 from machine.machine import Machine
@@ -24,6 +24,9 @@ class Mlmc(UqMethod):
 
     cname = "mlmc"
 
+    SamplingMethod = MonteCarlo
+    solver_sub_list = "levels"
+
     defaults_ = {
         "n_max_iter" : "NODEFAULT",   # number of iterations to safely approach optimal sample size
         "eps" : None,                 # prescribed means estimator RMSE 
@@ -34,6 +37,9 @@ class Mlmc(UqMethod):
         "dof_adj" : False             # use DOF-adjusted confidence intervals (strongly discouraged!!)
         }
 
+    # the sums required for these options are only accumulated if set
+    restart_fixed_prms = ["use_ci", "dof_adj"]
+
     defaults_add = { 
         "Solver": { 
             "n_warmup_samples": "NODEFAULT" # number of pilot runs per level
@@ -136,6 +142,73 @@ class Mlmc(UqMethod):
         if self.use_ci: 
             self.ci_conf_loc = 1.- (1.-self.ci_conf_tot) / (3.*len(self.levels))
 
+    def apply_prm_changes(self, new):
+        """
+        Restart with a changed parameter file. 
+        The levels of the restored simulation are kept with their
+        finished samples and sums, further levels can be appended
+        (i.e. finer ones). At the end of an iteration, the number of
+        samples for the next one is re-computed with the new eps or
+        total work. New levels first get their warmup samples; the
+        samples on all levels are then allocated in the following
+        iteration.
+        """
+        changed = self.changed_prms(new)
+        super().apply_prm_changes(new)
+
+        n_old = len(self.levels)
+        if len(new.levels) < n_old: 
+            raise InputPrmError("Levels cannot be removed on restart.")
+        for stage, stage_new in zip(self.stages,new.stages): 
+            for level, level_new in zip(getattr(stage,"levels",[]),getattr(stage_new,"levels",[])): 
+                for sub, sub_new in zip(level.sublevels,level_new.sublevels): 
+                    self.update_batch(sub,sub_new)
+
+        new_levels = new.levels[n_old:]
+        at_iter_end = self.current_iter is None or self.current_iter.finished \
+                or "Prepare next iteration" in self.current_iter.finished_steps
+        if new_levels: 
+            if not at_iter_end: 
+                raise InputPrmError("Levels can only be added at the end of an iteration. "
+                                    "Please restart from an earlier record.")
+            p_print("Add "+str(len(new_levels))+" level(s) with "
+                    "their warmup samples.")
+            # seed ids of the existing levels are kept
+            seed_id = max(l.samples.seed_id for l in self.levels)
+            for level in new_levels: 
+                seed_id += 1
+                level.samples.seed_id = seed_id
+                level.samples.stoch_vars = self.stoch_vars
+            for stage, stage_new in zip(self.stages,new.stages): 
+                if hasattr(stage,"levels"): 
+                    stage.levels.extend(stage_new.levels[n_old:])
+                # new batches are appended at the end of each stage
+                stage.batches.extend(stage_new.batches[len(stage.batches):])
+            register_batch_series(self.stages[:-1])
+            self.qois_optimize.extend(new.qois_optimize[n_old:])
+            for qoi, qoi_new in zip(self.internal_qois+self.simulation_postproc.batches,
+                                    new.internal_qois+new.simulation_postproc.batches):
+                qoi.participants.extend(qoi_new.participants[n_old:])
+        if self.use_ci: 
+            self.ci_conf_loc = 1.- (1.-self.ci_conf_tot) / (3.*len(self.levels))
+
+        if not at_iter_end or not self.iterations or not (changed or new_levels): 
+            # the next allocation uses the new parameters anyway
+            return
+
+        # allocation of the next iteration is re-done with the new parameters
+        n_finished_iter = self.current_iter.n
+        for level in self.levels[:n_old]: 
+            level.samples.n = 0
+        if new_levels: 
+            # warmup iteration plus one iteration for the allocation
+            self.n_max_iter = max(self.n_max_iter, n_finished_iter+2)
+            self.iter_loop_finished = False
+        else: 
+            self.n_max_iter = max(self.n_max_iter, n_finished_iter+1)
+            self.allocate_samples()
+
+
     def setup_level(self, i, sub_fine, sub_coarse, sampler, n_levels):
         """
         set up a level, connect to its sublevels, and 
@@ -164,7 +237,9 @@ class Mlmc(UqMethod):
         """
         Set up sampling method for a level
         """
-        samples = MonteCarlo(prms)
+        samples = self.SamplingMethod.create(prms)
+        if getattr(samples,"antithetic",False) and n_warmup % 2: 
+            raise InputPrmError("n_warmup_samples has to be even for antithetic sampling.")
         samples.stoch_vars = self.stoch_vars # copy to each sampler
         # initialize sample size
         samples.n = n_warmup
@@ -192,19 +267,12 @@ class Mlmc(UqMethod):
         if qoi.internal: 
             # stochastic post-proc is done internally 
             level.internal_qois.append(qoi)
-            # initialize sums: 
-            # Storing these sums, mean, variance and difference variance can be calculated
-            # Without storing the solution at every sample point. Sums can be updated 
+            # initialize moments: 
+            # Storing these, mean, variance and difference variance can be calculated
+            # Without storing the solution at every sample point. They are updated 
             # after every iteration, then estimators can be updated also.
-            qoi.u_fine_sum      = 0.
-            qoi.u_fine_sq_sum   = 0.
-            qoi.u_coarse_sum    = 0.
-            qoi.u_coarse_sq_sum = 0.
-            qoi.du_sq_sum       = 0.
+            self.init_moments(qoi)
             if self.use_ci: 
-                if self.dof_adj: 
-                    qoi.du_e3_sum = 0.
-                    qoi.du_e4_sum = 0.
                 qoi.w_sum = 0.
                 qoi.w_sq_sum = 0.
         else:
@@ -215,6 +283,41 @@ class Mlmc(UqMethod):
             self.stages[1].batches.append(qoi)
 
 
+    @staticmethod
+    def level_response(qoi): 
+        """
+        current responses of the fine and the coarse sublevel of a 
+        level's QoI (zero on the coarsest level)
+        """
+        u_out = qoi.get_response()
+        if len(u_out) == 2: 
+            return u_out
+        return u_out[0], 0.*u_out[0]
+
+
+    def init_moments(self,qoi): 
+        """
+        streaming moments of the fine and coarse responses and of the 
+        level differences (of the antithetic pair means, if used)
+        """
+        qoi.u_fine_moments   = StreamingMoments(order=2)
+        qoi.u_coarse_moments = StreamingMoments(order=2)
+        qoi.du_moments       = StreamingMoments(order=4)
+
+
+    @staticmethod
+    def moments_from_sums(qoi): 
+        """
+        convert the sums of simulations of older versions to moments
+        """
+        n, k = qoi.samples.n_previous, 2 if getattr(qoi.samples,"antithetic",False) else 1
+        qoi.u_fine_moments   = StreamingMoments.from_sums(n,qoi.u_fine_sum,qoi.u_fine_sq_sum)
+        qoi.u_coarse_moments = StreamingMoments.from_sums(n,qoi.u_coarse_sum,qoi.u_coarse_sq_sum)
+        qoi.du_moments       = StreamingMoments.from_sums(n//k,(qoi.u_fine_sum-qoi.u_coarse_sum)/k,
+                                                          qoi.du_sq_sum,getattr(qoi,"du_e3_sum",None),
+                                                          getattr(qoi,"du_e4_sum",None))
+
+
     def internal_iteration_postproc(self): 
         """
         Calculate sigma^2 for QoI's internally. 
@@ -224,23 +327,23 @@ class Mlmc(UqMethod):
             if level.samples.n == 0: 
                 continue
             for qoi in level.internal_qois: 
-                u_out = qoi.get_response()
-                if len(u_out) == 2: 
-                    u_fine, u_coarse = u_out
-                else: 
-                    u_fine, u_coarse = u_out[0], 0.*u_out[0]
-                n = qoi.samples.n_previous+qoi.samples.n
-                # Storing these sums, mean, variance and difference variance can be calculated
-                # Without storing the solution at every sample point. Sums can be updated 
-                # after every iteration, then estimators can be updated also.
-                qoi.u_fine_sum      += sum(u_fine)
-                qoi.u_fine_sq_sum   += sum(u_fine**2)
-                qoi.u_coarse_sum    += sum(u_coarse)
-                qoi.u_coarse_sq_sum += sum(u_coarse**2)
-                qoi.du_sq_sum       += sum([(f-c)**2 for f,c in zip(u_fine,u_coarse)])
-                qoi.SigmaSq = ( qoi.du_sq_sum - (qoi.u_fine_sum-qoi.u_coarse_sum)**2 / n) / (n-1)
-                qoi.SigmaSq = qoi.integrate(qoi.SigmaSq)
+                if not hasattr(qoi,"du_moments"): 
+                    self.moments_from_sums(qoi)
+                u_fine, u_coarse = self.level_response(qoi)
+                qoi.u_fine_moments.update(u_fine)
+                qoi.u_coarse_moments.update(u_coarse)
+                # antithetic pairs are one effective sample each (with mean
+                # differences du); SigmaSq is still given per sample
+                k = 2 if getattr(qoi.samples,"antithetic",False) else 1
+                du = np.asarray(u_fine) - np.asarray(u_coarse)
+                if k == 2: 
+                    du = antithetic_means(du)
+                qoi.du_moments.update(du)
+                n_eff = qoi.du_moments.n
+                qoi.SigmaSq = qoi.integrate(k*qoi.du_moments.var)
                 if self.use_ci: 
+                    # scipy is slow to import and only needed here
+                    from scipy.stats import chi2, norm
 
                     ## TODO: hack for convergence test: 
                     ## In convtest, the simulation setup is modified later and use_ci and dof_adj may be switched on.
@@ -257,14 +360,13 @@ class Mlmc(UqMethod):
 
                     # get upper and lower bound for level difference variance
                     if self.dof_adj: 
-                        qoi.du_e3_sum   += sum([(f-c)**3 for f,c in zip(u_fine,u_coarse)])
-                        qoi.du_e4_sum   += sum([(f-c)**4 for f,c in zip(u_fine,u_coarse)])
-                        mu = (qoi.u_fine_sum-qoi.u_coarse_sum)/n
-                        mom4 = qoi.du_e4_sum - 4.*mu*qoi.du_e3_sum + 6.*mu**2*qoi.du_sq_sum - 4.*mu**3*mu*n + n*mu**4
-                        ex_kurt = n*(n+1.)/((n-1.)*(n-2.)*(n-3.))*mom4/qoi.SigmaSq**2 - 3*(n-1.)**2/((n-2.)*(n-3.))
-                        dof = 2*n/(ex_kurt+2*n/(n-1.))
+                        # integrated like SigmaSq for vectorial QoIs
+                        mom4 = qoi.integrate(qoi.du_moments.m4)
+                        ex_kurt = n_eff*(n_eff+1.)/((n_eff-1.)*(n_eff-2.)*(n_eff-3.))*mom4/(qoi.SigmaSq/k)**2 \
+                                - 3*(n_eff-1.)**2/((n_eff-2.)*(n_eff-3.))
+                        dof = 2*n_eff/(ex_kurt+2*n_eff/(n_eff-1.))
                     else: 
-                        dof = n-1
+                        dof = n_eff-1
                     alpha = (1.-self.ci_conf_loc)*2.
                     qoi.v_lower = dof*qoi.SigmaSq/chi2.interval(1.-alpha,dof)[1]
                     qoi.v_upper = dof*qoi.SigmaSq/chi2.interval(1.-alpha,dof)[0]
@@ -279,6 +381,7 @@ class Mlmc(UqMethod):
                             w += np.array(qoi.participants[1].w)
                         qoi.w_sum += np.sum(w)
                         qoi.w_sq_sum += np.sum(w**2)
+                        n = qoi.samples.n_previous+qoi.samples.n
                         mean_w = qoi.w_sum/n
                         var_w  = (qoi.w_sq_sum-(qoi.w_sum**2)/n)/(n-1.)
                         qoi.w_lower = mean_w - norm.interval(1.-alpha)[1]*safe_sqrt(var_w/n)
@@ -310,13 +413,12 @@ class Mlmc(UqMethod):
             qoi.mean, qoi.variance = 0., 0.
             # loop over levels
             for p in qoi.participants:
-                n = p.samples.n_previous
+                if not hasattr(p,"du_moments"): 
+                    self.moments_from_sums(p)
                 # level mean
-                p.mean = (p.u_fine_sum - p.u_coarse_sum)/n
+                p.mean = p.u_fine_moments.mean - p.u_coarse_moments.mean
                 # level variance
-                f = (p.u_fine_sq_sum - p.u_fine_sum**2/n)
-                c = (p.u_coarse_sq_sum - p.u_coarse_sum**2/n)
-                p.variance = (f - c) / (n-1)
+                p.variance = p.u_fine_moments.var - p.u_coarse_moments.var
 
                 # add to sum
                 qoi.mean += p.mean
@@ -354,7 +456,14 @@ class Mlmc(UqMethod):
         """
 
         self.internal_iteration_postproc()
+        self.allocate_samples()
 
+
+    def allocate_samples(self): 
+        """
+        Get the number of new samples on every level from the current 
+        estimates of sigma^2 and work.
+        """
         self.all_est_total_work = []
         self.all_est_eps = []
 
@@ -441,6 +550,8 @@ class Mlmc(UqMethod):
                         expo = 1./sum(0.15**i for i in range(n_iter_remain))
                         n_total_new = qoi.mlopt**expo * qoi.samples.n_total_current**(1-expo)
                     qoi.n_new_samples = max(int(np.ceil(n_total_new))-qoi.samples.n_total_current , 0)
+                    if getattr(qoi.samples,"antithetic",False): 
+                        qoi.n_new_samples += qoi.n_new_samples % 2
 
                 else: # last iteration
                     qoi.n_new_samples = 0
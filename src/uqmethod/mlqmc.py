@@ -0,0 +1,155 @@
+import numpy as np
+from prettytable import PrettyTable
+
+from .mlmc import Mlmc
+from helpers.printtools import *
+from helpers.tools import *
+from sampling.sampling import QuasiMonteCarlo
+
+
+class Mlqmc(Mlmc):
+    """
+    Multilevel quasi Monte Carlo
+    Every level uses n_replicates independently scrambled replicates of
+    a low-discrepancy sequence (set in the sampling section). The
+    variance of each level estimator is estimated from the spread of the
+    replicate means, since the points of a replicate are not independent.
+    The number of points per replicate is doubled on the levels where
+    the variance reduction per work is largest, until eps or total_work
+    is reached. Before the last iteration, it is doubled at most once
+    per level and iteration, to re-estimate the variances in between.
+    n_warmup_samples is the number of points per replicate.
+    """
+
+    cname = "mlqmc"
+
+    SamplingMethod = QuasiMonteCarlo
+
+    max_doublings = 60 # per level and iteration
+
+
+    def __init__(self, input_prm_dict):
+        super().__init__(input_prm_dict)
+        if self.use_ci:
+            raise InputPrmError("MLQMC: use_ci is not available, the variances "
+                                "are estimated from the replicates.")
+
+
+    def setup(self, prms):
+        super().setup(prms)
+        if self.levels[0].samples.n_replicates < 2:
+            raise InputPrmError("MLQMC: set n_replicates >= 2 in the sampling section.")
+        for qoi in self.qois_optimize:
+            if not qoi.internal:
+                raise InputPrmError("MLQMC: the optimized QoI has to be an internal QoI.")
+
+
+    def setup_samples(self,prms,n_warmup):
+        samples = super().setup_samples(prms,n_warmup)
+        samples.n = n_warmup*samples.n_replicates
+        return samples
+
+
+    def setup_qoi(self, subdict, level, QoILoc):
+        super().setup_qoi(subdict, level, QoILoc)
+        qoi = level.qois[-1]
+        if qoi.internal:
+            # sums of the level differences per replicate
+            qoi.du_rep_sum = 0.
+
+
+    def internal_iteration_postproc(self):
+        """
+        In addition to the sums of MLMC, the level differences are
+        summed per replicate. The variance of the level estimator
+        (VarEst) is the variance of the replicate means divided by the
+        number of replicates.
+        """
+        super().internal_iteration_postproc()
+        for level in self.levels:
+            if level.samples.n == 0:
+                continue
+            n_rep = level.samples.n_replicates
+            n = (level.samples.n_previous+level.samples.n)//n_rep
+            for qoi in level.internal_qois:
+                u_fine, u_coarse = self.level_response(qoi)
+                du = np.asarray(u_fine - u_coarse)
+                # nodes are ordered by replicate
+                du = du.reshape((n_rep,-1)+du.shape[1:])
+                qoi.du_rep_sum = qoi.du_rep_sum + np.sum(du,axis=1)
+                qoi.VarEst = qoi.integrate(np.var(qoi.du_rep_sum/n,axis=0,ddof=1)/n_rep)
+
+
+    def internal_simulation_postproc(self):
+        """
+        MLMC estimators plus the estimated RMSE of the mean from the
+        replicates
+        """
+        super().internal_simulation_postproc()
+        for qoi in self.internal_qois:
+            qoi.rmse = safe_sqrt(sum(p.VarEst for p in qoi.participants))
+            p_print("Estimated RMSE of the mean of QoI "+qoi.cname+": %e"%(qoi.rmse))
+
+
+    def allocate_samples(self):
+        """
+        Plan doublings of the points per replicate for the optimized QoI.
+        Each doubling is assumed to halve the variance of the level
+        estimator (the Monte Carlo rate, QMC usually converges faster).
+        The doubling with the largest variance reduction per work is
+        chosen until the sum of the variances is below eps^2 or the
+        next doubling exceeds the total work. Levels without measured 
+        work (zero cost) cannot be ranked and are not doubled; at most 
+        max_doublings doublings are planned per level.
+        """
+        qois = self.qois_optimize # one per level
+        var = np.array([float(q.get_derived_quantity("VarEst")) for q in qois])
+        work = np.array([q.work_mean for q in qois])
+        n = np.array([q.samples.n_total_current for q in qois])
+        n_doubling = np.zeros(len(qois),dtype=int)
+
+        n_iter_remain = self.n_max_iter-self.current_iter.n
+        while n_iter_remain > 0:
+            var_new = var/2.**n_doubling
+            cost = n*2**n_doubling*work
+            candidates = (cost > 0.) & (n_doubling < self.max_doublings)
+            if self.eps:
+                if np.sum(var_new) <= self.eps**2:
+                    break
+            else:
+                candidates &= np.sum(cost) + cost <= self.total_work
+            if not np.any(candidates):
+                break
+            gain = np.where(candidates,var_new/cost,-1.)
+            n_doubling[np.argmax(gain)] += 1
+
+        if n_iter_remain > 1:
+            # approach the planned sample numbers carefully
+            n_doubling = np.minimum(n_doubling,1)
+
+        # stdout
+        print()
+        p_print("Evaluate QoI " + self.qois_optimize[0].cname + " (OPTIMIZED!)")
+        table = PrettyTable()
+        table.field_names = ["Level","VarEst","mean work","finished Samples","new Samples"]
+        for q, v, w, n_loc, k in zip(qois,var,work,n,n_doubling):
+            q.n_new_samples = int(n_loc*(2**k-1))
+            table.add_row([q.levelname, v, w, n_loc, q.n_new_samples])
+        print_table(table)
+        print()
+        n_new = n*2**n_doubling
+        self.est_eps = safe_sqrt(np.sum(var/2.**n_doubling))
+        self.est_total_work = np.sum(n_new*work)
+        if self.eps:
+            p_print("Estimated total work after next iteration: %d core-seconds"%(int(self.est_total_work)))
+        p_print("Estimated RMSE after next iteration: %e"%(self.est_eps))
+        self.all_est_eps = [self.est_eps]
+        self.all_est_total_work = [self.est_total_work]
+
+        # Update sample size for next iteration
+        for qoi in self.qois_optimize:
+            qoi.samples.n_previous += qoi.samples.n
+            qoi.samples.n = qoi.n_new_samples
+
+        # check if iteration loop should be exited
+        self.iter_loop_finished = len(self.stages[0].active_batches) == 0
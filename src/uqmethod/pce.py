@@ -13,13 +13,20 @@ from helpers import globels
 
 class PCE(UqMethod):
     """
-    Stochastic GaussianQuadrature (non-adaptive)
+    Stochastic GaussianQuadrature
+    With an adaptive sampling method (adaptive_sparse_grid), the grid is
+    refined in up to n_max_iter iterations, based on the first QoI. 
+    Only the new nodes are evaluated in each iteration.
     """
 
     cname = "pce"
 
     SamplingMethod = GaussianQuadrature
 
+    defaults_ = {
+        "n_max_iter" : 1   # only > 1 for adaptive sampling methods
+        }
+
     def __init__(self, input_prm_dict):
         """
         Called at beginning of config routine.
@@ -28,7 +35,6 @@ class PCE(UqMethod):
         super().__init__(input_prm_dict)
 
         self.has_simulation_postproc = False
-        self.n_max_iter = 1
 
 
     def setup(self, prms):
@@ -44,8 +50,10 @@ class PCE(UqMethod):
         self.stoch_vars = config.config_list("stoch_vars", prms, StochVar.create,
                                              SolverLoc)
         
-        self.samples = GaussianQuadrature(prms["sampling"])
+        self.samples = self.SamplingMethod.create(prms["sampling"])
         self.samples.stoch_vars = self.stoch_vars
+        if self.n_max_iter > 1 and not self.samples.adaptive: 
+            raise InputPrmError("PCE: n_max_iter > 1 requires an adaptive sampling method.")
 
         for i_stage, stage in enumerate(self.stages): 
             solver = Solver.create_by_stage_from_list(prms["solver"],i_stage,
@@ -65,16 +73,26 @@ class PCE(UqMethod):
             qoi.participants = self.stages[-2].batches
             if qoi.internal: 
                 self.internal_qois.append(qoi)
+            elif self.samples.adaptive: 
+                raise InputPrmError("PCE: adaptive sampling requires internal QoIs.")
             else: 
                 self.stages[-1].batches.append(qoi)
 
 
     def prepare_next_iteration(self):
         """
-        There is only one "iteration", so no next 
-        one needs to be prepared.
+        Without adaptive sampling, there is only one "iteration", 
+        so no next one needs to be prepared. 
+        Else, the grid is refined based on the contributions of the 
+        active indices to mean and second moment of the first QoI.
         """
         self.internal_iteration_postproc()
+        if self.current_iter.n < self.n_max_iter: 
+            qoi = self.internal_qois[0]
+            def indicator(weights): 
+                return qoi.integrate(np.abs(np.dot(np.transpose(qoi.u_all),weights))) \
+                     + qoi.integrate(np.abs(np.dot(np.transpose(qoi.u_all**2),weights)))
+            self.iter_loop_finished = not self.samples.refine(indicator)
 
 
     def internal_iteration_postproc(self): 
@@ -90,6 +108,11 @@ class PCE(UqMethod):
         for qoi in self.internal_qois: 
 
             u_out = qoi.get_response()[0]
+            if self.samples.adaptive: 
+                # weights refer to all nodes evaluated so far
+                n_previous = self.samples.n_previous
+                qoi.u_all = np.concatenate((qoi.u_all[:n_previous],u_out)) if n_previous else u_out
+                u_out = qoi.u_all
 
             # This is the actual stochastic prost-processing / weighted sum
             qoi.mean = np.dot(np.transpose(u_out),self.samples.weights)
@@ -12,6 +12,11 @@ class UqMethod(Simulation,BaseClass):
     the whole simulation.
     """
 
+    # section of the parameter file with the solver setup and the
+    # name of its sub-list (e.g. levels), used to check the parameters
+    solver_section = "solver"
+    solver_sub_list = None
+
     def get_samples(self,batches):
         """
         The sampling method is determined during setup, so this is 
@@ -25,7 +30,52 @@ class UqMethod(Simulation,BaseClass):
     def internal_simulation_postproc(self): 
         pass
 
+    # input parameters of the UQ method which cannot be changed on restart
+    restart_fixed_prms = []
+
+    def apply_prm_changes(self,new):
+        """
+        Restart with a changed parameter file: new is the simulation set 
+        up from this file. Its parameters are copied to this (restored) 
+        simulation, which keeps all finished samples and their 
+        statistics. UQ methods extend this routine for changes which 
+        require further samples.
+        """
+        changed = self.changed_prms(new)
+        for prm_name in changed: 
+            if prm_name in self.restart_fixed_prms: 
+                raise InputPrmError("'"+prm_name+"' cannot be changed on restart.")
+            p_print("Changed parameter "+yellow(prm_name)+": "
+                    +str(getattr(self,prm_name,None))+" -> "+str(getattr(new,prm_name)))
+        self.update_prms(new)
+        self.cfg = new.cfg
+        self.machines = new.machines
+
+        if [s.name for s in self.stages] != [s.name for s in new.stages]: 
+            raise InputPrmError("Stages cannot be changed on restart.")
+        for stage, stage_new in zip(self.stages,new.stages): 
+            stage.update_prms(stage_new)
+
+        if len(self.stoch_vars) != len(new.stoch_vars) or \
+                any(v.changed_prms(vn) for v,vn in zip(self.stoch_vars,new.stoch_vars)): 
+            raise InputPrmError("Stochastic variables cannot be changed on restart.")
+
+        # the simulation post-processing is repeated with the new setup
+        if self.current_iter and self.current_iter.name == "simulation postproc": 
+            self.iterations.pop()
+            self.current_iter = self.iterations[-1]
+
+    def update_batch(self,batch,batch_new): 
+        """
+        Copy the input parameters of a batch set up from the changed 
+        parameter file to the restored batch. Changes which affect the 
+        result of a sample evaluation are not allowed, since the finished
+        samples could then not be used anymore.
+        """
+        if batch.cache_config() != batch_new.cache_config(): 
+            raise InputPrmError("Setup of batch "+batch.name+" has changed. Its finished "
+                                "samples cannot be re-used on restart.")
+        batch.update_prms(batch_new)
 
 
-# import subclasses
-from . import *
+# subclasses are imported on demand (see BaseClass.subclass)